@@ -23,13 +23,16 @@
 # SOFTWARE.
 
 import os
+import fcntl
 import subprocess
 import sys
 import shutil
 import logging
-from typing import List, Any, Optional
+import time
+from typing import Callable, Dict, List, Any, Optional, Set, Tuple
 from pathlib import Path
 from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from os import getenv
 from tempfile import TemporaryDirectory
 from collections import namedtuple
@@ -102,6 +105,71 @@ ImageInfo = namedtuple(
 )
 
 
+# ioctl which makes the destination file a copy-on-write clone of the source file
+FICLONE = 0x40049409
+
+
+def clone_file(src: str, dst: str, hardlink: bool = False) -> str:
+    """
+    Copy function for shutil.copytree, which shares data with the source file
+    if the filesystem supports reflinks or, if allowed, hardlinks.
+    Falls back to a plain copy otherwise.
+    """
+    try:
+        with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        shutil.copystat(src, dst)
+        return dst
+    except OSError:
+        pass
+    if hardlink:
+        try:
+            os.unlink(dst)
+            os.link(src, dst)
+            return dst
+        except OSError:
+            pass
+    return str(shutil.copy2(src, dst))
+
+
+def snapshot_tree(
+    src: Path,
+    dst: Path,
+    ignore: Optional[Callable[[str, List[str]], Set[str]]] = None,
+    hardlink: bool = False,
+) -> Any:
+    """
+    Copy the directory tree, sharing the file data with the source where possible.
+    Hardlinks may be used only if the source is not going to be modified
+    while the copy is used, or vice versa.
+    """
+    shutil.copytree(
+        src,
+        dst,
+        symlinks=True,
+        ignore=ignore,
+        copy_function=lambda s, d: clone_file(s, d, hardlink=hardlink),
+    )
+
+
+def parse_upstream_list(output: str) -> Dict[Tuple[str, str], List[ImageInfo]]:
+    """
+    Parse output of 'utils listupstream' into an index of the images
+    keyed by the upstream name and version.
+    Lines which do not describe an image are skipped.
+    """
+    index: Dict[Tuple[str, str], List[ImageInfo]] = {}
+    for line in output.splitlines():
+        # Fields are:
+        # python-27 python-27 s2i-python-container https://github.com/sclorg/s2i-python-container.git 2.7 rhel-8.4.0
+        fields = line.split()
+        if len(fields) != len(ImageInfo._fields):
+            continue
+        img_info = ImageInfo._make(fields)
+        index.setdefault((img_info.upstream_name, img_info.ver), []).append(img_info)
+    return index
+
+
 class BetkaGenerator(object):
     def __init__(self) -> None:
         self.os_env: Optional[str] = getenv("OS")
@@ -113,7 +181,10 @@ class BetkaGenerator(object):
         self.cwt_command = "cwt"
         self.cwt_config = "default.yaml"
         self.upstream_image_name = self.cur_dir.name
-        self.ups_sources = ""
+        self.upstream_index: Optional[Dict[Tuple[str, str], List[ImageInfo]]] = None
+        self.jobs: int = int(getenv("BETKA_JOBS") or "1")
+        self.mirror_dir: Optional[Path] = self.get_mirror_dir()
+        self.mirror_max_age: int = int(getenv("BETKA_MIRROR_MAX_AGE") or "30")
 
     def check_requirements(self) -> bool:
         if not self.cwt_docker_image:
@@ -168,20 +239,27 @@ git config --global user.name <your name>
             )
             shutil.rmtree(results_dir)
 
-    def get_valid_images(self, ver: str) -> List[str]:
+    def load_upstream_index(self) -> Dict[Tuple[str, str], List[ImageInfo]]:
+        """
+        Run 'utils listupstream' only once per invocation
+        and keep its output indexed by the upstream name and version.
+        """
+        if self.upstream_index is not None:
+            return self.upstream_index
+        self.upstream_index = {}
         if self.os_env != "fedora":
             if not self.convert_branch_to_cwt_tool():
-                return []
+                return self.upstream_index
         cmd = f"""docker run -it --rm {self.cwt_docker_image} bash -c '{self.cwt_command} \
 --config={self.cwt_config} utils listupstream'
 """
         docker_output = run_cmd(cmd, return_output=True, shell=True)
-        valid_images = []
-        for line in docker_output.split("\n"):
-            # Fields are:
-            # python-27 python-27 s2i-python-container https://github.com/sclorg/s2i-python-container.git 2.7 rhel-8.4.0
-            if self.upstream_image_name in line and ver == line.split(" ")[4]:
-                valid_images.append(line)
+        self.upstream_index = parse_upstream_list(docker_output)
+        return self.upstream_index
+
+    def get_valid_images(self, ver: str) -> List[ImageInfo]:
+        index = self.load_upstream_index()
+        valid_images = index.get((self.upstream_image_name, ver), [])
         logging.debug(f"Valid images {valid_images}")
         return valid_images
 
@@ -205,65 +283,189 @@ git config --global user.name <your name>
             return False
         return True
 
-    def clone_and_switch_to_branch(self, downstream_name: str, branch_name: str) -> Any:
-        cmd = f"git clone --branch {branch_name} {self.clone_url}/{downstream_name} {self.betka_tmp_dir.name}/results"
+    @staticmethod
+    def get_mirror_dir() -> Optional[Path]:
+        """
+        Directory with bare mirrors of the dist-git repositories.
+        Defaults to ~/.cache/betka/mirrors, empty BETKA_MIRROR_DIR disables the mirrors.
+        """
+        mirror_dir = getenv("BETKA_MIRROR_DIR")
+        if mirror_dir is None:
+            cache_dir = getenv("XDG_CACHE_HOME") or str(Path.home() / ".cache")
+            return Path(cache_dir) / "betka" / "mirrors"
+        if not mirror_dir:
+            return None
+        return Path(mirror_dir)
+
+    def evict_mirrors(self) -> Any:
+        """
+        Remove mirrors which were not used for more than BETKA_MIRROR_MAX_AGE days.
+        """
+        if not self.mirror_dir or not self.mirror_dir.is_dir():
+            return
+        if self.mirror_max_age <= 0:
+            return
+        oldest = time.time() - self.mirror_max_age * 24 * 60 * 60
+        for mirror in self.mirror_dir.glob("*.git"):
+            if mirror.stat().st_mtime < oldest:
+                logging.debug(f"Mirror {mirror} was not used recently, removing it.")
+                shutil.rmtree(mirror, ignore_errors=True)
+
+    def clone_from_mirror(
+        self, downstream_name: str, branch_name: str, target: str
+    ) -> Any:
+        """
+        Fetch only new commits into the local mirror of the dist-git repository
+        and clone the branch from it. The clone's origin points to the dist-git.
+        """
+        assert self.mirror_dir is not None
+        url = f"{self.clone_url}/{downstream_name}"
+        mirror = self.mirror_dir / f"{downstream_name}.git"
+        self.mirror_dir.mkdir(parents=True, exist_ok=True)
+        with open(self.mirror_dir / f".{downstream_name}.lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if (mirror / "HEAD").exists():
+                run_cmd(f"git -C {mirror} remote set-url origin {url}", shell=True)
+                run_cmd(f"git -C {mirror} fetch --prune --quiet origin", shell=True)
+            else:
+                shutil.rmtree(mirror, ignore_errors=True)
+                run_cmd(f"git clone --mirror --quiet {url} {mirror}", shell=True)
+            run_cmd(f"git clone --branch {branch_name} {mirror} {target}", shell=True)
+            os.utime(mirror)
+        run_cmd(f"git -C {target} remote set-url origin {url}", shell=True)
+
+    def clone_and_switch_to_branch(
+        self, downstream_name: str, branch_name: str, tmp_dir: str
+    ) -> Any:
+        if self.mirror_dir:
+            self.clone_from_mirror(downstream_name, branch_name, f"{tmp_dir}/results")
+            return
+        cmd = f"git clone --branch {branch_name} {self.clone_url}/{downstream_name} {tmp_dir}/results"
         run_cmd(cmd, shell=True)
 
-    def copy_upstream_sources(self) -> Any:
-        p = Path(f"{self.betka_tmp_dir.name}/{self.upstream_image_name}")
+    def referenced_versions(self, ver: str) -> Set[str]:
+        """
+        Top-level directories of the repository the symlinks in the version point to,
+        e.g. a minimal version sharing files with the full one.
+        """
+        referenced = set()
+        for root, dirs, files in os.walk(self.cur_dir / ver):
+            for name in dirs + files:
+                path = Path(root) / name
+                if not path.is_symlink():
+                    continue
+                try:
+                    target = path.resolve().relative_to(self.cur_dir)
+                except ValueError:
+                    continue
+                referenced.add(target.parts[0])
+        return referenced
+
+    def snapshot_ignore(self, ver: str) -> Callable[[str, List[str]], Set[str]]:
+        """
+        Ignore VCS data, generated results and all versions except the generated one
+        when copying the upstream sources.
+        """
+        versions = set(self.versions_env.split()) if self.versions_env else set()
+        other_versions = versions - {ver} - self.referenced_versions(ver)
+
+        def ignore(directory: str, names: List[str]) -> Set[str]:
+            ignored = {n for n in names if n == ".git" or n.startswith("results-")}
+            if Path(directory) == self.cur_dir:
+                ignored |= other_versions.intersection(names)
+            return ignored
+
+        return ignore
+
+    def copy_upstream_sources(self, tmp_dir: str, ver: str) -> Any:
+        p = Path(f"{tmp_dir}/{self.upstream_image_name}")
         if p.exists():
             shutil.rmtree(p)
         logging.debug(f"Upstream sources are copied to {p}")
-        shutil.copytree(self.cur_dir, f"{p}", symlinks=True)
+        # The sources are mounted read-write to the generator container,
+        # so they must not be hardlinked to the working tree
+        snapshot_tree(self.cur_dir, p, ignore=self.snapshot_ignore(ver))
 
-    def generate_sources(self, downstream_name: str) -> Any:
+    def generate_sources(self, downstream_name: str, tmp_dir: str) -> Any:
         cmd = f"""docker run -it --rm -v {Path.home()}/.gitconfig:/root/.gitconfig:ro,Z \
--v {self.betka_tmp_dir.name}:{self.betka_tmp_dir.name}:rw,Z -e WORKDIR={self.betka_tmp_dir.name} \
+-v {tmp_dir}:{tmp_dir}:rw,Z -e WORKDIR={tmp_dir} \
 -e DOWNSTREAM_IMAGE_NAME={downstream_name} \
 -e UPSTREAM_IMAGE_NAME={self.upstream_image_name} {self.cwt_docker_image}
 """
         run_cmd(cmd, shell=True)
 
-    def copy_generated_source(self, ver: str) -> Any:
-        shutil.copytree(
-            Path(f"{self.betka_tmp_dir.name}/results"),
-            self.cur_dir / f"results-{ver}",
-            symlinks=True,
+    def copy_generated_source(self, ver: str, tmp_dir: str) -> Any:
+        # The temporary directory is removed afterwards, so hardlinks are safe
+        snapshot_tree(
+            Path(f"{tmp_dir}/results"), self.cur_dir / f"results-{ver}", hardlink=True
         )
 
+    def generate_image(self, img_info: ImageInfo) -> Tuple[bool, float]:
+        """
+        Generate dist-git sources of a single image in its own temporary directory.
+        Returns whether the generation succeeded and how long it took.
+        """
+        time_beg = time.monotonic()
+        try:
+            with TemporaryDirectory() as tmp_dir:
+                self.copy_upstream_sources(tmp_dir, ver=img_info.ver)
+                self.clone_and_switch_to_branch(
+                    downstream_name=img_info.downstream_name,
+                    branch_name=img_info.branch,
+                    tmp_dir=tmp_dir,
+                )
+                self.generate_sources(
+                    downstream_name=img_info.downstream_name, tmp_dir=tmp_dir
+                )
+                self.copy_generated_source(ver=img_info.ver, tmp_dir=tmp_dir)
+        except (subprocess.CalledProcessError, OSError) as ex:
+            logging.error(
+                f"Generating sources for {img_info.downstream_name} failed: {ex}"
+            )
+            return False, time.monotonic() - time_beg
+        return True, time.monotonic() - time_beg
+
     def convert_sources(self) -> int:
-        generated_sources = []
+        images: List[ImageInfo] = []
         if not self.versions_env:
             return 1
         for ver in self.versions_env.split():
-            with cwd(str(self.cur_dir / ver)):
-                self.delete_generated_dirs(ver)
-                valid_images = self.get_valid_images(ver)
-                if not valid_images:
-                    logging.info(
-                        f"'{self.cwt_command}' did not detect any valid images by command 'utils listupstream'."
-                    )
-                    return 0
-                for img in valid_images:
-                    self.betka_tmp_dir = TemporaryDirectory()
-                    img_info = ImageInfo._make(img.split())
-                    self.ups_sources = (
-                        f"{self.betka_tmp_dir.name}/{self.upstream_image_name}"
-                    )
-                    self.copy_upstream_sources()
-                    self.clone_and_switch_to_branch(
-                        downstream_name=img_info.downstream_name,
-                        branch_name=img_info.branch,
-                    )
-                    self.generate_sources(downstream_name=img_info.downstream_name)
-                    self.copy_generated_source(ver=img_info.ver)
-                    generated_sources.append(f"results-{ver}")
-                    self.betka_tmp_dir.cleanup()
+            self.delete_generated_dirs(ver)
+            valid_images = self.get_valid_images(ver)
+            if not valid_images:
+                logging.info(
+                    f"'{self.cwt_command}' did not detect any valid images for version {ver} "
+                    f"by command 'utils listupstream'."
+                )
+                continue
+            images.extend(valid_images)
+        if not images:
+            return 0
+
+        self.evict_mirrors()
+        logging.info(
+            f"Generating sources for {len(images)} images, {self.jobs} at a time."
+        )
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            results = list(executor.map(self.generate_image, images))
+
+        logging.info("Summary of 'make betka':")
+        for img_info, (success, duration) in zip(images, results):
+            status = "OK" if success else "FAILED"
+            logging.info(
+                f"{status:8} {img_info.downstream_name:30} {img_info.branch:20} "
+                f"results-{img_info.ver} ({duration:.0f}s)"
+            )
+        generated_sources = sorted(
+            {f"results-{img.ver}" for img, (ok, _) in zip(images, results) if ok}
+        )
         if generated_sources:
             logging.info(
                 "Dist-git sources generated by 'make betka' are stored in this/these directories:"
             )
             logging.info("\n".join(generated_sources))
+        if not all(success for success, _ in results):
+            return 1
         return 0
 
 
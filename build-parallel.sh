@@ -0,0 +1,94 @@
+#!/bin/bash
+
+# This script builds the OpenShift Docker images of all versions in parallel.
+#
+# OS - Specifies distribution - "rhel8", "rhel9", "rhel10", "c9s", "c10s" or "fedora"
+# VERSIONS - Must be set to a list with possible versions (subdirectories)
+# BUILD_JOBS - Maximum number of versions built at the same time,
+#              defaults to the number of available CPUs
+# BUILD_LOG_DIR - Directory for the build logs of the versions,
+#                 a new temporary directory is used by default
+#
+# Each version is built by build.sh in its own process, so the version
+# directory (.image-id, .image-id-from) and the build options are not shared
+# with other versions. Base images used by several versions are pulled only
+# once, before the builds start. The latest tag is added after all the builds
+# finish, to the same version as a serial build would tag.
+
+[ -n "${DEBUG:-}" ] && set -x
+
+# shellcheck shell=bash
+# shellcheck source=/dev/null
+source "$(dirname "${BASH_SOURCE[0]}")"/common.sh
+
+build="$(dirname "${BASH_SOURCE[0]}")/build.sh"
+BUILD_JOBS=${BUILD_JOBS:-$(nproc)}
+BUILD_LOG_DIR=${BUILD_LOG_DIR:-$(mktemp -d "/tmp/build-${OS}.XXXXXX")}
+mkdir -p "$BUILD_LOG_DIR"
+
+# build_version VERSION
+# -----------------------------
+# Builds a single version by build.sh. The output is stored in a log file
+# of the version and printed with the version as a prefix.
+# The exit code and build time are stored in VERSION.status file.
+build_version() {
+  local version="$1"
+  local log_file="$BUILD_LOG_DIR/${version}.log"
+  local time_beg
+  local ret_code
+
+  time_beg=$(date '+%s')
+  set -o pipefail
+  VERSION="$version" SKIP_LATEST_TAG=1 bash "$build" 2>&1 | tee "$log_file" | sed -u "s|^|[$version] |"
+  ret_code=$?
+  set +o pipefail
+  echo "$ret_code $(( $(date '+%s') - time_beg ))" > "$BUILD_LOG_DIR/${version}.status"
+}
+
+echo "Built versions are: $VERSIONS (at most $BUILD_JOBS at a time)"
+echo "Build logs are stored in $BUILD_LOG_DIR"
+
+# Pull base images shared by the versions only once, build.sh reuses them
+VERSION="" VERSIONS="$VERSIONS" PULL_ONLY=1 bash "$build"
+
+for dir in ${VERSIONS}; do
+  while [ "$(jobs -rp | wc -l)" -ge "$BUILD_JOBS" ]; do
+    wait -n
+  done
+  build_version "$dir" &
+done
+wait
+
+failed_versions=""
+latest_image_id=""
+echo "----------------------------------------------"
+printf "%-20s %-8s %-10s %s\n" "VERSION" "STATUS" "TIME" "IMAGE ID"
+for dir in ${VERSIONS}; do
+  read -r ret_code duration < "$BUILD_LOG_DIR/${dir}.status"
+  image_id=""
+  if [ "$ret_code" -ne 0 ]; then
+    status="FAILED"
+    failed_versions="$failed_versions $dir"
+  elif [ -f "$dir/.image-id" ]; then
+    status="OK"
+    image_id=$(cat "$dir/.image-id")
+    # A serial build tags every built version as latest in turn, until
+    # a version fails
+    [ -n "$failed_versions" ] || latest_image_id=$image_id
+  else
+    status="SKIPPED"
+  fi
+  printf "%-20s %-8s %-10s %s\n" "$dir" "$status" "$(date -u -d "@$duration" +%H:%M:%S)" "$image_id"
+done
+echo "----------------------------------------------"
+
+if [ -n "$latest_image_id" ]; then
+  name=$(docker inspect -f "{{.Config.Labels.name}}" "$latest_image_id")
+  echo "-> Tagging image '$latest_image_id' as '$REGISTRY$name:latest'"
+  docker tag "$latest_image_id" "$REGISTRY$name:latest"
+fi
+
+if [ -n "$failed_versions" ]; then
+  echo "Build failed for these versions:${failed_versions}. See logs in $BUILD_LOG_DIR."
+  exit 1
+fi
@@ -6,6 +6,19 @@
 # VERSION - Specifies the image version - (must match with subdirectory in repo)
 # SINGLE_VERSION - Specifies the image version - (must match with subdirectory in repo)
 # VERSIONS - Must be set to a list with possible versions (subdirectories)
+# PULL_ONLY - If set, only pull the base images of the versions and exit
+# BASE_IMAGES_FILE - File with the base images pulled before the build and
+#                    their digests (default: base-images-$OS in the git
+#                    directory, .base-images-$OS outside of git repositories)
+# METRICS_FILE - If set, durations of the build phases (pull, build attempts,
+#                retry sleeps, tagging) are appended to it as JSON lines
+# MAX_BUILD_ATTEMPTS - How many times a build failing for a transient reason
+#                      (see failure-patterns) is attempted (default: 3)
+# FAILURE_PATTERNS_FILE - File with additional patterns of transient and
+#                         deterministic failures, see failure-patterns
+# FORCE_BUILD - If set, images are built even if the image in .image-id has
+#               the same build cache key
+# SKIP_LATEST_TAG - If set, the image is not tagged as latest
 
 set -E
 [ -n "${DEBUG:-}" ] && set -x
@@ -21,7 +34,11 @@ error() { echo "ERROR: $*" ; false ; }
 
 trap 'echo "errexit on line $LINENO, $0" >&2' ERR
 
-MAX_BUILD_ATTEMPTS=2
+MAX_BUILD_ATTEMPTS=${MAX_BUILD_ATTEMPTS:-3}
+# Kept in the git directory, so that it does not show up in the work tree
+BASE_IMAGES_FILE=${BASE_IMAGES_FILE:-$(git rev-parse --path-format=absolute --git-path "base-images-$OS" 2>/dev/null \
+  || echo "$PWD/.base-images-$OS")}
+BUILD_CACHE_KEY_LABEL=io.sclorg.build-cache-key
 
 
 # "best-effort" cleanup of image
@@ -38,42 +55,64 @@ function clean_image {
 }
 
 # Pull image based on FROM, before we build our own.
+# Images already pulled by pull_base_images are reused.
 function pull_image {
   local dockerfile="$1"
-  local loops=10
-  local loop=0
+  local image_name
+  local digest
+  local time_beg
 
-  # Get image_name from Dockerfile before pulling.
-  while read -r line; do
-    if ! grep -q "^FROM" <<< "$line"; then
-      continue
-    fi
-
-    image_name=$(echo "$line" | cut -d ' ' -f2)
-
-    # In case FROM scratch is defined, skip it
-    if [[ "$image_name" == "scratch" ]]; then
+  for image_name in $(get_base_images "$dockerfile"); do
+    if digest=$(get_recorded_digest "$BASE_IMAGES_FILE" "$image_name"); then
+      echo "-> Using already pulled image $image_name ($digest)."
       continue
     fi
     echo "-> Pulling image $image_name before building image from $dockerfile."
-    # Sometimes in Fedora case it fails with HTTP 50X
-    # Check if the image is available locally and try to pull it if it is not
-    if [[ "$(docker images -q "$image_name" 2>/dev/null)" != "" ]]; then
-      echo "The image $image_name is already pulled."
-      continue
+    time_beg=$(metrics_timestamp)
+    if ! pull_base_image "$image_name" .image-id-from; then
+      record_metric pull "$dir" "$time_beg" 1 image="$image_name"
+      return 1
     fi
+    record_metric pull "$dir" "$time_beg" 0 image="$image_name"
+    echo "$image_name $(get_image_digest "$image_name")" >> "$BASE_IMAGES_FILE"
+  done
+}
 
-    # Try pulling the image to see if it is accessible
-    # WORKAROUND: Since Fedora registry sometimes fails randomly, let's try it more times
-    while ! docker pull "$image_name" > .image-id-from; do
-      ((loop++)) || :
-      echo "Pulling image $image_name failed."
-      [ "$loop" -gt "$loops" ] && { echo "It happened $loops times. Giving up." ; return 1; }
-      echo "Let's wait $((loop*5)) seconds and try again."
-      sleep "$((loop*5))"
+# build_cache_key DOCKERFILE
+# -----------------------------
+# Prints a hash of everything the image built from DOCKERFILE depends on:
+# the Dockerfile, the files in DOCKER_BUILD_CONTEXT, digests of the base
+# images, BUILD_OPTIONS and the content of CUSTOM_REPO and of the
+# .build-args-$OS and .devel-repo-$OS files.
+function build_cache_key {
+  local dockerfile="$1"
+  local options="$BUILD_OPTIONS"
+  local image_name
+  local digest
+  local marker
+  local skip=( \( -name .git -o -name '.image-id*' -o -name '.base-images-*'
+               -o -name .repo-model.json -o -name .generator-cache \) -prune )
+  {
+    echo "dockerfile $(sha256sum < "$dockerfile")"
+    for image_name in $(get_base_images "$dockerfile"); do
+      digest=$(get_recorded_digest "$BASE_IMAGES_FILE" "$image_name") \
+        || digest=$(get_image_digest "$image_name" 2>/dev/null)
+      echo "from $image_name $digest"
     done
-
-  done < "$dockerfile"
+    # The path of CUSTOM_REPO differs for every build, its content does not
+    if [ -n "$CUSTOM_REPO" ]; then
+      options=${options//"$CUSTOM_REPO"/custom-repo}
+      echo "custom-repo $(find "$CUSTOM_REPO" -type f -print0 | LC_ALL=C sort -z | xargs -0r cat | sha256sum)"
+    fi
+    echo "options $options"
+    for marker in ".build-args-$OS" ".devel-repo-$OS"; do
+      [ -f "$marker" ] && echo "$marker $(sha256sum < "$marker")"
+    done
+    # Names, types, modes, sizes and symlink targets of the context files,
+    # then their content
+    find "$DOCKER_BUILD_CONTEXT" "${skip[@]}" -o -printf '%P %y %m %s %l\n' | LC_ALL=C sort
+    find "$DOCKER_BUILD_CONTEXT" "${skip[@]}" -o -type f -print0 | LC_ALL=C sort -z | xargs -0r cat | sha256sum
+  } | sha256sum | cut -d' ' -f1
 }
 
 # Perform docker build but append the LABEL with GIT commit id at the end
@@ -85,24 +124,29 @@ function docker_build_with_version {
   local build_args_file=.build-args-${OS}
   local is_podman
   local ret_code
-  if [ -e "$exclude" ]; then
+  local squash=0
+  local time_beg
+  local cache_key
+  local image_id
+  local failure
+  local failure_reason
+  local delay=5
+  local sleep_time
+  # Options and the custom repository of this version only
+  local BUILD_OPTIONS="${BUILD_OPTIONS:-}"
+  local CUSTOM_REPO="${CUSTOM_REPO:-}"
+  if is_listed "$REPO_EXCLUDED_VERSIONS" "$dir"; then
     echo "-> $exclude file exists for version $dir, skipping build."
     clean_image
     return
   fi
-  if [ ! -e "$dockerfile" ]; then
+  if ! is_listed "$REPO_DOCKERFILE_VERSIONS" "$dir"; then
     echo "-> $dockerfile for version $dir does not exist, skipping build."
     clean_image
     return
   fi
   echo "-> Version ${dir}: building image from '${dockerfile}' ..."
 
-  # We need to check '.git' dir in root directory
-  if [ -d "../.git" ] ; then
-    git_version=$(git rev-parse --short HEAD)
-    BUILD_OPTIONS+=" --label io.openshift.builder-version=\"${git_version}\""
-  fi
-
   # Add possibility to use a development repo
   #
   # This is useful if we want to work with RPMs that are not available publically yet.
@@ -118,7 +162,7 @@ function docker_build_with_version {
   #
   # That means that definition of the DEVEL_REPO_rhel8 variable is a responsibility of
   # the test/CI environment.
-  if [ -f "$devel_repo_file" ] && [[ -v "$devel_repo_var" ]] ; then
+  if is_listed "$REPO_DEVEL_REPO_VERSIONS" "$dir" && [[ -v "$devel_repo_var" ]] ; then
     CUSTOM_REPO=$(mktemp)
     curl -Lk "${!devel_repo_var}" >"${CUSTOM_REPO}"
     echo "-> $devel_repo_file file exists for version $dir, so using ${!devel_repo_var}."
@@ -137,7 +181,7 @@ function docker_build_with_version {
   # If a specific Dockerfile requires some specific build options (like capabilities),
   # let them be included in the build command.
   # The content of the .build-opts-<OS> will be used as part of the docker build command.
-  if [ -f "$build_args_file" ] ; then
+  if is_listed "$REPO_BUILD_ARGS_VERSIONS" "$dir" ; then
       build_opts_from_file="$(cat "$build_args_file")"
       echo '⚠️ Be aware, using additional build arguments: ' "${build_opts_from_file}"
       BUILD_OPTIONS+=" ${build_opts_from_file}"
@@ -150,7 +194,31 @@ function docker_build_with_version {
   # squash is possible only for podman. In docker it is usable only in experimental mode.
   if [[ "$SKIP_SQUASH" -eq 0 ]] && [[ "$is_podman" -eq 1 ]]; then
     BUILD_OPTIONS+=" --squash"
+    squash=1
   fi
+
+  # We need to check '.git' dir in root directory. The label is a part of
+  # the cache key, so an image built from another commit is not reused.
+  if [ -d "../.git" ] ; then
+    git_version=$(git rev-parse --short HEAD)
+    BUILD_OPTIONS+=" --label io.openshift.builder-version=\"${git_version}\""
+  fi
+
+  # Reuse the last image if none of its inputs changed since it was built
+  cache_key=$(build_cache_key "$dockerfile")
+  if [ -z "${FORCE_BUILD:-}" ] && [ -f .image-id ]; then
+    image_id=$(cat .image-id)
+    if [ -n "$image_id" ] && [ "$(docker inspect -f "{{index .Config.Labels \"$BUILD_CACHE_KEY_LABEL\"}}" "$image_id" 2>/dev/null)" == "$cache_key" ]; then
+      echo "-> Version ${dir}: image $image_id is up to date (build cache key $cache_key), skipping build."
+      IMAGE_ID="$image_id"
+      time_beg=$(metrics_timestamp)
+      tag_image
+      record_metric tag "$dir" "$time_beg" 0 image_id="$IMAGE_ID" cached=1
+      return
+    fi
+  fi
+  BUILD_OPTIONS+=" --label $BUILD_CACHE_KEY_LABEL=$cache_key"
+
   i=1
   build_failed=1
   while [ $i -le $MAX_BUILD_ATTEMPTS ]; do
@@ -158,25 +226,44 @@ function docker_build_with_version {
     echo "-> building using $command"
     set +x -o pipefail
     tmp_file=$(mktemp "/tmp/${dir}-${OS}.XXXXXX")
-    $command 2>&1 | tee "$tmp_file"
+    time_beg=$(metrics_timestamp)
+    $command 2>&1 | classify_output "$tmp_file.class" | tee "$tmp_file"
     ret_code=$?
     set -x +o pipefail
+    { read -r failure; read -r failure_reason; } < "$tmp_file.class"
+    rm -f "$tmp_file.class"
+    if [[ $ret_code != "0" ]]; then
+      record_metric build "$dir" "$time_beg" "$ret_code" attempt="$i" squash="$squash" failure="$failure"
+    else
+      record_metric build "$dir" "$time_beg" "$ret_code" attempt="$i" squash="$squash"
+    fi
     echo "Return code from docker build is '$ret_code'."
     last_row=$(< "$tmp_file" tail -n 1)
     if [[ $ret_code != "0" ]]; then
-      # In case of failure, we want to analyze the logs and send them to pastebin or logdetective.
-      # The failure can be ethel issue like network failure or registry failure.
+      echo "-> Build failure of version $dir looks ${failure}${failure_reason:+, because of: $failure_reason}"
+      # Only failures like network or registry errors are worth retrying, e.g.:
       # Red Hat Enterprise Linux 9 for x86_64 - AppStre 0.0  B/s |   0  B     00:00
       # Errors during downloading metadata for repository 'rhel-9-for-x86_64-appstream-rpms':
       #  - Curl error (56): Failure when receiving data from the peer for https:// [Received HTTP code 503 from proxy after CONNECT]
       # Error: Failed to download metadata for repo 'rhel-9-for-x86_64-appstream-rpms':
+      if [[ "$failure" == "transient" ]] && [ $i -lt $MAX_BUILD_ATTEMPTS ]; then
+        rm -f "$tmp_file"
+        ((i++))
+        sleep_time=$(( delay + RANDOM % (delay / 2 + 1) ))
+        time_beg=$(metrics_timestamp)
+        sleep "$sleep_time"
+        record_metric retry-sleep "$dir" "$time_beg" 0 attempt="$i"
+        delay=$(( delay * 2 > 60 ? 60 : delay * 2 ))
+        echo "Retrying to build image for version $dir after $sleep_time seconds, attempt $i of $MAX_BUILD_ATTEMPTS."
+        continue
+      fi
+      # In case of the final failure, we want to analyze the logs and send them to pastebin or logdetective.
       if [[ "${OS}" == "rhel8" ]] || [[ "${OS}" == "rhel9" ]] || [[ "${OS}" == "rhel10" ]]; then
         # Do not fail in case of sending log to pastebin or logdetective fails.
         analyze_logs_by_logdetective "${tmp_file}"
       fi
-      ((i++))
-      sleep 5
-      echo "Retrying to build image for version $dir, attempt $i of $MAX_BUILD_ATTEMPTS."
+      rm -f "$tmp_file"
+      break
     else
       # Structure of log build is as follows:
       # COMMIT
@@ -187,15 +274,16 @@ function docker_build_with_version {
         IMAGE_ID="$last_row"
       fi
       echo "$IMAGE_ID" > .image-id
+      time_beg=$(metrics_timestamp)
       tag_image
+      record_metric tag "$dir" "$time_beg" 0 image_id="$IMAGE_ID"
       build_failed=0
       break
     fi
-
-    rm -f "$tmp_file"
   done
   if [[ $build_failed -ne 0 ]]; then
-    echo "-> Build failed for version $dir and OS $OS after 2 attempts, giving up."
+    echo "-> Build failed for version $dir and OS $OS after $i attempt(s), giving up."
+    record_metric version-build "$dir" "$version_time_beg" 1
     exit 1
   fi
 
@@ -212,11 +300,15 @@ function tag_image {
   fi
 
   full_reg_name="$REGISTRY$name"
-  echo "-> Tagging image '$IMAGE_ID' as '$full_reg_name:$dir' and '$full_reg_name:latest' and '$full_reg_name:$OS' and '$full_reg_name:$date_and_hash'"
+  if [ -n "${SKIP_LATEST_TAG:-}" ]; then
+    echo "-> Tagging image '$IMAGE_ID' as '$full_reg_name:$dir' and '$full_reg_name:$OS' and '$full_reg_name:$date_and_hash'"
+  else
+    echo "-> Tagging image '$IMAGE_ID' as '$full_reg_name:$dir' and '$full_reg_name:latest' and '$full_reg_name:$OS' and '$full_reg_name:$date_and_hash'"
+  fi
 
   docker tag "$IMAGE_ID" "$full_reg_name:$OS"
   docker tag "$IMAGE_ID" "$full_reg_name:$dir"
-  docker tag "$IMAGE_ID" "$full_reg_name:latest"
+  [ -n "${SKIP_LATEST_TAG:-}" ] || docker tag "$IMAGE_ID" "$full_reg_name:latest"
   docker tag "$IMAGE_ID" "$full_reg_name:$date_and_hash"
 }
 
@@ -240,10 +332,38 @@ if [ -n "${SINGLE_VERSION:-}" ]; then
 fi
 echo "Built versions are: $dirs"
 
+# Dockerfiles and marker files (.exclude-$OS, .devel-repo-$OS, .build-args-$OS)
+# of the versions, scanned once for all of them
+# shellcheck disable=SC2086
+eval "$(python3 "$(dirname "${BASH_SOURCE[0]}")/repo_model.py" --os "$OS" --format shell $dirs)" || exit 1
+
+# Pull base images of all the versions at once, before the builds start
+dockerfiles=()
+for dir in ${dirs}; do
+  is_listed "$REPO_EXCLUDED_VERSIONS" "$dir" && continue
+  is_listed "$REPO_DOCKERFILE_VERSIONS" "$dir" && dockerfiles+=("${dir}/Dockerfile.${OS}")
+done
+if [ -n "${PULL_ONLY:-}" ]; then
+  [ ${#dockerfiles[@]} -eq 0 ] && exit 0
+  time_beg=$(metrics_timestamp)
+  pull_base_images "$BASE_IMAGES_FILE" "${dockerfiles[@]}"
+  ret_code=$?
+  record_metric pull-base-images "" "$time_beg" "$ret_code"
+  exit $ret_code
+fi
+if [ ${#dockerfiles[@]} -gt 1 ]; then
+  time_beg=$(metrics_timestamp)
+  pull_base_images "$BASE_IMAGES_FILE" "${dockerfiles[@]}"
+  ret_code=$?
+  record_metric pull-base-images "" "$time_beg" "$ret_code"
+fi
+
 for dir in ${dirs}; do
   # shellcheck disable=SC2164
   pushd "${dir}" > /dev/null
+  version_time_beg=$(metrics_timestamp)
   docker_build_with_version Dockerfile."$OS"
+  record_metric version-build "$dir" "$version_time_beg" 0
   # shellcheck disable=SC2164
   popd > /dev/null
 done
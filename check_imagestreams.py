@@ -24,21 +24,47 @@
 
 import sys
 import json
-import logging
-import os
+import argparse
 
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional, Set
 
 IMAGESTREAMS_DIR: str = "imagestreams"
 
 
-class ImageStreamChecker(object):
-    version: str = ""
+class ImageStreamIndex(object):
+    """Tags of a single image stream file, indexed by the stream version."""
+
+    def __init__(self, json_dict: Dict[Any, Any]):
+        self.tags: Dict[str, Dict[Any, Any]] = {}
+        self.streams: Set[str] = set()
+        for tag in json_dict["spec"]["tags"]:
+            name = tag["name"]
+            self.tags[name] = tag
+            # The name can be "<stream>" or "<stream>-elX" or "<stream>-ubiX"
+            self.streams.add(name)
+            pos = name.find("-")
+            while pos != -1:
+                self.streams.add(name[:pos])
+                pos = name.find("-", pos + 1)
+
+    def has_version(self, version: str) -> bool:
+        return version in self.streams
+
+    def latest_target(self) -> Optional[str]:
+        latest = self.tags.get("latest")
+        if latest is None:
+            return None
+        return str(latest["from"]["name"])
 
-    def __init__(self, version: str):
-        self.version = version
-        self.results: Dict[Any, Any] = {}
+
+class ImageStreamChecker(object):
+    def __init__(self, versions: List[str], latest: Optional[str] = None):
+        self.versions = versions
+        # The latest tag has to link to the last version by default
+        self.latest = latest if latest is not None else versions[-1]
+        self.results: Dict[str, Dict[str, Any]] = {}
 
     def load_json_file(self, filename: Path) -> Any:
         with open(str(filename)) as f:
@@ -46,60 +72,87 @@ class ImageStreamChecker(object):
             isinstance(data, Dict)
             return data
 
-    def check_version(self, json_dict: Dict[Any, Any]) -> List[str]:
-        res = []
-        for tags in json_dict["spec"]["tags"]:
-            print(
-                f"check_version: Compare tags['name']:'{tags['name']}' against version:'{self.version}'"
-            )
-            # The name can be"<stream>" or "<stream>-elX" or "<stream>-ubiX"
-            if tags["name"] == self.version or tags["name"].startswith(
-                self.version + "-"
-            ):
-                res.append(tags)
-        return res
-
-    def check_latest_tag(self, json_dict: Dict[Any, Any]) -> bool:
-        latest_tag_correct: bool = False
-        for tags in json_dict["spec"]["tags"]:
-            if tags["name"] != "latest":
+    def check_file(self, filename: Path) -> Dict[str, Any]:
+        index = ImageStreamIndex(self.load_json_file(filename))
+        missing = [v for v in self.versions if not index.has_version(v)]
+        latest_target = index.latest_target()
+        # The latest can link to either "<stream>" or "<stream>-elX" or "<stream>-ubiX"
+        latest_ok = latest_target is not None and (
+            latest_target == self.latest or latest_target.startswith(self.latest + "-")
+        )
+        return {
+            "missing_versions": missing,
+            "latest_tag": latest_target,
+            "latest_ok": latest_ok,
+            "ok": not missing and latest_ok,
+        }
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "versions": self.versions,
+            "latest": self.latest,
+            "files": self.results,
+            "ok": all(r["ok"] for r in self.results.values()),
+        }
+
+    def print_summary(self) -> None:
+        for f, res in self.results.items():
+            if res["ok"]:
                 continue
-            print(
-                f"check_latest_tag: Compare tags['name']:'{tags['name']}' against version:'{self.version}'"
-            )
-            # The latest can link to either "<stream>" or "<stream>-elX" or "<stream>-ubiX"
-            if tags["from"]["name"] == self.version or tags["from"]["name"].startswith(
-                self.version + "-"
-            ):
-                latest_tag_correct = True
-                print(f"Latest tag found.")
-        return latest_tag_correct
-
-    def check_imagestreams(self) -> int:
+            if res["missing_versions"]:
+                print(f"{f}: missing versions {', '.join(res['missing_versions'])}.")
+            if not res["latest_ok"]:
+                print(
+                    f"{f}: latest tag links to '{res['latest_tag']}', "
+                    f"expected '{self.latest}'."
+                )
+        failed = sum(1 for res in self.results.values() if not res["ok"])
+        print(
+            f"Checked {len(self.results)} image stream files for versions "
+            f"{', '.join(self.versions)} (latest {self.latest}): {failed} failed."
+        )
+
+    def check_imagestreams(self, jobs: Optional[int] = None) -> int:
         p = Path(".")
-        json_files = p.glob(f"{IMAGESTREAMS_DIR}/*.json")
+        json_files = sorted(p.glob(f"{IMAGESTREAMS_DIR}/*.json"))
         if not json_files:
             print(f"No json files present in {IMAGESTREAMS_DIR}.")
             return 0
-        for f in json_files:
-            print(f"Checking file {str(f)}.")
-            json_dict = self.load_json_file(f)
-            if not (self.check_version(json_dict) and self.check_latest_tag(json_dict)):
-                print(
-                    f"The latest version is not present in {str(f)} or in latest tag."
-                )
-                self.results[f] = False
-        if self.results:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            for f, res in zip(json_files, executor.map(self.check_file, json_files)):
+                self.results[str(f)] = res
+        self.print_summary()
+        if not self.report()["ok"]:
             return 1
-        print("Imagestreams contains the latest version.")
+        print("Imagestreams contains the checked versions.")
         return 0
 
 
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        logging.fatal("%s: %s", sys.argv[0], "VERSION as an argument was not provided")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(
+        description="Check that the image streams contain the versions "
+        "and that their latest tag links to the latest version."
+    )
+    parser.add_argument("versions", nargs="+", metavar="VERSION")
+    parser.add_argument(
+        "-l",
+        "--latest",
+        help="Version the latest tag has to link to, the last VERSION by default",
+    )
+    parser.add_argument(
+        "-r", "--report", help="Write the report in JSON to this file ('-' for stdout)"
+    )
+    parser.add_argument(
+        "-j", "--jobs", type=int, help="Number of files checked at the same time"
+    )
+    args = parser.parse_args()
 
-    print(f"Version to check is {sys.argv[1]}.")
-    isc = ImageStreamChecker(version=sys.argv[1])
-    sys.exit(isc.check_imagestreams())
+    print(f"Versions to check are {', '.join(args.versions)}.")
+    isc = ImageStreamChecker(versions=args.versions, latest=args.latest)
+    ret = isc.check_imagestreams(jobs=args.jobs)
+    if args.report == "-":
+        print(json.dumps(isc.report()))
+    elif args.report:
+        with open(args.report, "w") as f:
+            json.dump(isc.report(), f, indent=2)
+    sys.exit(ret)
@@ -3,6 +3,8 @@
 [ -n "${DEBUG:-}" ] && set -x
 
 test -f auto_targets.mk && rm auto_targets.mk
+rm -f .base-images-*
+base_images=$(git rev-parse --git-path base-images 2>/dev/null) && rm -f "$base_images"-*
 
 for version; do
   for id_file in .image-id .image-id-from; do
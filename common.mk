@@ -10,6 +10,7 @@ ifndef common_dir
 endif
 
 build = $(SHELL) $(common_dir)/build.sh
+build_parallel = $(SHELL) $(common_dir)/build-parallel.sh
 test =  $(SHELL) $(common_dir)/test.sh
 shellcheck =  $(SHELL) $(common_dir)/run-shellcheck.sh
 clean = $(SHELL) $(common_dir)/clean.sh
@@ -66,14 +67,25 @@ script_env = \
 	DOCKER_BUILD_CONTEXT=$(DOCKER_BUILD_CONTEXT)    \
 	OPENSHIFT_NAMESPACES="$(OPENSHIFT_NAMESPACES)"  \
 	CUSTOM_REPO="$(CUSTOM_REPO)" \
+	METRICS_FILE="$(METRICS_FILE)" \
+	FORCE_BUILD="$(FORCE_BUILD)" \
+	MAX_BUILD_ATTEMPTS="$(MAX_BUILD_ATTEMPTS)" \
+	MAX_TEST_ATTEMPTS="$(MAX_TEST_ATTEMPTS)" \
+	FAILURE_PATTERNS_FILE="$(FAILURE_PATTERNS_FILE)" \
+	TEST_JOBS="$(TEST_JOBS)" \
+	CT_APP_IMAGE_CACHE="$(CT_APP_IMAGE_CACHE)" \
 	REGISTRY="$(REGISTRY)"
 
-# TODO: switch to 'build: build-all' once parallel builds are relatively safe
-.PHONY: build build-serial build-all
+# TODO: switch to 'build: build-parallel' once parallel builds are relatively safe
+.PHONY: build build-serial build-all build-parallel
 build: build-serial
 build-serial:
 	@$(MAKE) -j1 build-all
 
+# Builds all versions concurrently, at most BUILD_JOBS at a time
+build-parallel: copy_md_files
+	VERSIONS="$(VERSIONS)" BUILD_JOBS="$(BUILD_JOBS)" $(script_env) $(build_parallel)
+
 build-all: $(VERSIONS)
 	@for i in $(VERSIONS); do \
 	    test -f $$i/.image-id || continue ; \
@@ -82,9 +94,14 @@ build-all: $(VERSIONS)
 	done
 
 .PHONY: $(VERSIONS)
-$(VERSIONS): copy_md_files
+$(VERSIONS): copy_md_files pull-base-images
 	VERSION="$@" $(script_env) $(build)
 
+# Pull base images of all versions once, concurrently, before they are built
+.PHONY: pull-base-images
+pull-base-images:
+	VERSIONS="$(VERSIONS)" PULL_ONLY=1 $(script_env) $(build)
+
 .PHONY: test check
 check: test
 
@@ -124,6 +141,7 @@ betka:
 	VERSIONS="$(VERSIONS)" \
     DOWNSTREAM_NAME="$(DOWNSTREAM_NAME)" \
     DOCKER_IMAGE="$(DOCKER_IMAGE)" \
+    BETKA_JOBS="$(BETKA_JOBS)" \
     $(script_env) $(betka)
 
 .PHONY: clean clean-hook clean-images clean-versions
@@ -134,7 +152,7 @@ clean-images:
 	$(clean) $(VERSIONS)
 
 clean-versions:
-	rm -rf $(VERSIONS)
+	rm -rf $(VERSIONS) .repo-model.json "$$(git rev-parse --git-path generator-cache 2>/dev/null)"
 
 # Copy also all .md files from version directory to the root of
 # container images, so that they are available in the image
@@ -157,15 +175,35 @@ remove_md_files:
 
 generate-all: generate
 
+# All versions sharing a manifest are generated by a single generator.py call,
+# which generates them in parallel.  GENERATOR_JOBS limits how many versions
+# are generated at once (defaults to the number of available CPUs).
+# With GENERATOR_CACHE set, files whose inputs did not change are not generated
+# again; the inputs are recorded in the git directory, outside of the work tree.
+generator_args = -s specs/multispec.yml $(if $(GENERATOR_JOBS),-j $(GENERATOR_JOBS)) \
+	$(if $(GENERATOR_CACHE),--cache-dir "$$(git rev-parse --git-path generator-cache)")
+
+# run_generator [ARGS]
+# Runs generator.py with additional ARGS for all versions
+run_generator = \
+	versions="$(filter-out %-minimal,$(VERSIONS))" ; \
+	if [ -n "$$versions" ]; then \
+		$(generator) -m manifest.yml $(generator_args) $(1) -v $$versions || exit 1 ; \
+	fi ; \
+	versions="$(filter %-minimal,$(VERSIONS))" ; \
+	if [ -n "$$versions" ]; then \
+		$(generator) -m manifest-minimal.yml $(generator_args) $(1) -v $$versions || exit 1 ; \
+	fi
+
 .PHOHY: generate
 generate:
-	for version in ${VERSIONS} ; do \
-		if [[ "$$version" == *-minimal ]]; then \
-			$(generator) -v $$version -m manifest-minimal.yml -s specs/multispec.yml ; \
-		else \
-			$(generator) -v $$version -m manifest.yml -s specs/multispec.yml ; \
-		fi \
-	done
+	$(call run_generator)
+
+# Checks that the generated files in the version directories are up to date,
+# without writing anything
+.PHONY: check-generated
+check-generated:
+	$(call run_generator,--check)
 
 version-table:
 	$(common_dir)/generate_version_table.py "$(BASE_IMAGE_NAME)"
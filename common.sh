@@ -7,6 +7,78 @@ else
   return 0
 fi
 
+# is_listed LIST ITEM
+# -----------------------------
+# Returns 0 if the space separated LIST contains the ITEM.
+is_listed() {
+  [[ " $1 " == *" $2 "* ]]
+}
+
+# shellcheck source=/dev/null
+source "$(dirname "${BASH_SOURCE[0]}")"/metrics.sh
+
+# Patterns of transient and deterministic failures, see the file for details.
+# The paths are made absolute, since the scripts change directories.
+FAILURE_PATTERNS=$(realpath -m "$(dirname "${BASH_SOURCE[0]}")/failure-patterns")
+if [ -n "${FAILURE_PATTERNS_FILE:-}" ]; then
+  FAILURE_PATTERNS_FILE=$(realpath -m "$FAILURE_PATTERNS_FILE")
+  export FAILURE_PATTERNS_FILE
+fi
+
+# classify_output CLASS_FILE
+# -----------------------------
+# Copies the standard input to the standard output line by line, as it is
+# produced, and matches the lines against the patterns in FAILURE_PATTERNS
+# and FAILURE_PATTERNS_FILE (if set). When the input ends, the class of the
+# output, 'transient' or 'deterministic', is written to the first line of
+# CLASS_FILE and the line that decided it (if any) to the second one.
+# Argument: CLASS_FILE - file to write the class to
+classify_output() {
+  local class_file="$1"
+  local patterns=("$FAILURE_PATTERNS")
+  [ -n "${FAILURE_PATTERNS_FILE:-}" ] && patterns+=("$FAILURE_PATTERNS_FILE")
+  awk -v class_file="$class_file" '
+    FILENAME != "-" {
+      if ($1 == "transient" || $1 == "deterministic") {
+        class[n] = $1
+        sub(/^[^ \t]+[ \t]+/, "")
+        pattern[n++] = $0
+      }
+      next
+    }
+    {
+      print
+      fflush()
+      if (result == "deterministic") next
+      for (i = 0; i < n; i++) {
+        if ($0 ~ pattern[i] && (class[i] == "deterministic" || result == "")) {
+          result = class[i]
+          reason = $0
+          if (result == "deterministic") break
+        }
+      }
+    }
+    END {
+      print (result == "" ? "deterministic" : result) > class_file
+      print reason > class_file
+    }
+  ' "${patterns[@]}" -
+}
+
+# classify_failure LOG_FILE
+# -----------------------------
+# Prints the class of a failure, 'transient' or 'deterministic', based on
+# its LOG_FILE. See classify_output.
+classify_failure() {
+  local class_file
+  local class
+  class_file=$(mktemp)
+  classify_output "$class_file" < "$1" > /dev/null
+  read -r class < "$class_file"
+  rm -f "$class_file"
+  echo "$class"
+}
+
 analyze_logs_by_logdetective() {
   echo "Analyse logs by logdetective, why it failed."
   # logdetective should not break the test functionality
@@ -43,3 +115,115 @@ analyze_logs_by_logdetective() {
   echo "File '${logdetective_test_file}' stored to '$TMT_TEST_DATA'."
   echo "-------- LOGDETECTIVE TEST LOG ANALYSIS FINISHED --------"
 }
+
+# get_base_images DOCKERFILE...
+# -----------------------------
+# Prints distinct images used by FROM instructions of the given Dockerfiles.
+# 'scratch' and names of earlier build stages are skipped.
+get_base_images() {
+  awk '
+    FNR == 1 { split("", stages) }
+    toupper($1) == "FROM" {
+      # skip options like --platform=...
+      for (i = 2; i <= NF && $i ~ /^--/; i++) ;
+      image = $i
+      if (toupper($(i + 1)) == "AS") stages[$(i + 2)] = 1
+      if (image != "scratch" && !(image in stages)) print image
+    }
+  ' "$@" | sort -u
+}
+
+# pull_base_image IMAGE [OUTPUT_FILE]
+# -----------------------------
+# Pulls IMAGE unless it is already available locally. Since registries
+# (Fedora especially) sometimes fail randomly with HTTP 50X, the pull is
+# retried with an exponential back-off. The delay has a random jitter, so
+# concurrent pulls do not retry all at the same time.
+# Argument: OUTPUT_FILE - file to store the standard output of 'docker pull'
+pull_base_image() {
+  local image_name="$1"
+  local output_file="${2:-/dev/null}"
+  local loops=10
+  local loop=0
+  local delay=5
+  local sleep_time
+
+  # Check if the image is available locally and try to pull it if it is not
+  if [[ "$(docker images -q "$image_name" 2>/dev/null)" != "" ]]; then
+    echo "The image $image_name is already pulled."
+    return 0
+  fi
+
+  # Try pulling the image to see if it is accessible
+  while ! docker pull "$image_name" > "$output_file"; do
+    ((loop++)) || :
+    echo "Pulling image $image_name failed."
+    [ "$loop" -gt "$loops" ] && { echo "It happened $loops times. Giving up." ; return 1; }
+    sleep_time=$(( delay + RANDOM % (delay / 2 + 1) ))
+    echo "Let's wait $sleep_time seconds and try again."
+    sleep "$sleep_time"
+    delay=$(( delay * 2 > 60 ? 60 : delay * 2 ))
+  done
+}
+
+# get_image_digest IMAGE
+# -----------------------------
+# Prints the repository digest of a local IMAGE, or its ID if it has none.
+get_image_digest() {
+  docker inspect -f '{{if .RepoDigests}}{{index .RepoDigests 0}}{{else}}{{.Id}}{{end}}' "$1"
+}
+
+# get_recorded_digest IMAGES_FILE IMAGE
+# -----------------------------
+# Prints the digest of IMAGE recorded by pull_base_images in IMAGES_FILE.
+# Returns 1 if IMAGE is not recorded there.
+get_recorded_digest() {
+  local images_file="$1"
+  local image_name="$2"
+  [ -f "$images_file" ] || return 1
+  awk -v image="$image_name" '$1 == image { print $2; found = 1 } END { exit !found }' "$images_file"
+}
+
+# pull_base_images IMAGES_FILE DOCKERFILE...
+# -----------------------------
+# Pulls every distinct base image of the given Dockerfiles only once, at most
+# PULL_JOBS (default 4) images at the same time, and records the images with
+# their digests into IMAGES_FILE, one "<image> <digest>" per line.
+# Returns 1 if any of the images could not be pulled.
+pull_base_images() {
+  local images_file="$1" ; shift
+  local pull_jobs="${PULL_JOBS:-4}"
+  local tmp_dir
+  local image_name
+  local i=0
+  local ret=0
+
+  tmp_dir=$(mktemp -d)
+  for image_name in $(get_base_images "$@"); do
+    while [ "$(jobs -rp | wc -l)" -ge "$pull_jobs" ]; do
+      wait -n
+    done
+    (
+      echo "-> Pulling base image $image_name."
+      if pull_base_image "$image_name" && digest=$(get_image_digest "$image_name"); then
+        echo "$image_name $digest" > "$tmp_dir/$i"
+      else
+        echo "$image_name" > "$tmp_dir/$i.failed"
+      fi
+    ) 2>&1 | sed -u "s|^|[pull $image_name] |" &
+    i=$(( i + 1 ))
+  done
+  wait
+
+  : > "$images_file"
+  for i in $(seq 0 $(( i - 1 ))); do
+    if [ -f "$tmp_dir/$i" ]; then
+      cat "$tmp_dir/$i" >> "$images_file"
+    else
+      echo "Pulling image $(cat "$tmp_dir/$i.failed") failed."
+      ret=1
+    fi
+  done
+  rm -rf "$tmp_dir"
+  return "$ret"
+}
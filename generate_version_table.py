@@ -1,9 +1,10 @@
 #!/usr/bin/env python3
-import os
 import re
 import sys
 from natsort import natsorted
 
+from repo_model import RepoModel
+
 distro_names = {
     "c9s": ["CentOS Stream 9", "quay.io/sclorg/%s-c9s"],
     "c10s": ["CentOS Stream 10", "quay.io/sclorg/%s-c10s"],
@@ -12,10 +13,6 @@ distro_names = {
     "rhel9": ["RHEL 9", "registry.redhat.io/rhel9/%s"],
     "rhel10": ["RHEL 10", "registry.redhat.io/rhel10/%s"],
 }
-version_regex = re.compile(r"^VERSIONS\s*=\s*(.*)$")
-docker_file_regex = re.compile(r"(?<=Dockerfile\.).+")
-exclude_file_regex = re.compile(r"(?<=\.exclude-).+")
-
 table_regex = re.compile(
     r"(<!--\nTable start\n-->\n).*?(<!--\nTable end\n-->\n)", re.DOTALL
 )
@@ -25,7 +22,7 @@ def main(name: str) -> None:
     docker_distros = {}
     all_distros = set()
 
-    versions = _get_versions()
+    versions, model = _get_versions()
     if len(versions) == 0:
         print(
             "No VERSIONS variable found in Makefile, please make sure the syntax is correct",
@@ -36,9 +33,8 @@ def main(name: str) -> None:
     # goes through all the versions and gets their dockerfile
     # and 'exclude-' distros
     for version in versions:
-        files = "\n".join(os.listdir(version))
-        available_distros: set[str] = set(re.findall(docker_file_regex, files))
-        exclude_distros = set(re.findall(exclude_file_regex, files))
+        available_distros: set[str] = set(model.distros(version))
+        exclude_distros = set(model.version_info[version]["excludes"])
         unsupported = available_distros - distro_names.keys()
         if len(unsupported) > 0:
             print(
@@ -57,20 +53,17 @@ def main(name: str) -> None:
 
 
 # gets the versions of the container from the Makefile
-def _get_versions() -> list[str]:
+# together with the model of the repository
+def _get_versions() -> tuple[list[str], RepoModel]:
     try:
-        with open("Makefile", "r") as f:
-            for line in f:
-                match = re.search(version_regex, line)
-                if match:
-                    return match.group(1).split(" ")
+        model = RepoModel.load()
     except Exception as e:
         print(
             f"An exception occurred when trying to read the Makefile: {e}",
             file=sys.stderr,
         )
         exit(1)
-    return []
+    return model.versions, model
 
 
 # generates the table string
@@ -1,16 +1,41 @@
 #!/usr/bin/env python3
 
 import argparse
+import copy
+import hashlib
+import io
+import json
 import re
+import sys
+import tempfile
+import traceback
 from collections import defaultdict
-from os import chmod, makedirs, mkdir, symlink, unlink
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stderr, redirect_stdout
+from importlib import metadata
+from os import (
+    chmod,
+    environ,
+    makedirs,
+    mkdir,
+    readlink,
+    rmdir,
+    sched_getaffinity,
+    symlink,
+    unlink,
+)
+from os.path import normpath
 from pathlib import Path
 from shutil import copy2, rmtree
-from subprocess import CalledProcessError, check_output
-from typing import Dict, List, TextIO
+from subprocess import DEVNULL, PIPE, CalledProcessError, check_output, run
+from typing import Any, Dict, List, Optional, Set, TextIO, Tuple, Union
 
+import jinja2
 import yaml
-from distgen.multispec import Multispec
+from distgen.commands import Commands, CommandsConfig
+from distgen.config import load_config, merge_yaml
+from distgen.generator import Generator
+from distgen.multispec import Multispec, MultispecError
 
 
 def run_distgen(
@@ -19,7 +44,8 @@ def run_distgen(
     multispec_path: str,
     distro_config: str,
     version: str,
-) -> None:
+) -> bool:
+    """Run `dg` for a single template, return False if it failed."""
     cmd = [
         "dg",
         "--multispec",
@@ -34,17 +60,193 @@ def run_distgen(
         str(dest),
     ]
 
+    # stderr of dg goes through sys.stderr, so it ends up in the log
+    # of the version when the versions are generated in parallel
+    result = run(cmd, stdout=DEVNULL, stderr=PIPE, text=True)
+    sys.stderr.write(result.stderr)
     try:
-        check_output(cmd)
+        result.check_returncode()
     except CalledProcessError as e:
         # Exit code 2 is a special code for non existing matrix combinations
         # It's not an actual error, hence don't print out its error message
         if e.returncode != 2:
             print("[ERROR] distgen failed:", e)
+            return False
+    return True
+
+
+class DgRenderer(object):
+    """Render distgen templates by running the `dg` command for every rule."""
+
+    def __init__(self, multispec_path: str) -> None:
+        self.multispec_path = multispec_path
+
+    def render(self, src: str, dest: Path, distro_config: str, version: str) -> bool:
+        return run_distgen(src, dest, self.multispec_path, distro_config, version)
+
+    def render_bytes(
+        self, src: str, distro_config: str, version: str
+    ) -> Optional[bytes]:
+        """Render a template into memory, through a temporary file.
+
+        None is returned for a non existing matrix combination.
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            dest = Path(tmp_dir) / "output"
+            if not self.render(src, dest, distro_config, version):
+                raise RuntimeError(f"distgen failed to render {src}")
+            return dest.read_bytes() if dest.exists() else None
+
+
+class DistgenRenderer(object):
+    """Render distgen templates in-process through the distgen Python API.
+
+    This does the same as `dg --multispec ... --template ... --distro ...`,
+    but the distgen project, the Jinja environment, the multispec and every
+    distro config are loaded only once and reused by all rendered rules.
+    """
+
+    # Same defaults as the `dg` command line uses
+    jinja_args = {"trim_blocks": True, "lstrip_blocks": True}
+    max_passes = 32
+
+    def __init__(self, multispec: Multispec, project_dir: str = ".") -> None:
+        self.generator = Generator(global_jinja_args=self.jinja_args)
+        self.generator.load_project(project_dir)
+        self.project = self.generator.project
+        self.multispec = multispec
+        self.cmd_cfg = CommandsConfig()
+        self.cmd_cfg.container = False
+        self._configs: Dict[str, Dict[str, Any]] = {}
+        self._specs: Dict[Tuple[str, str], Dict[str, Any]] = {}
+
+    def load_distro_config(self, distro_config: str) -> Dict[str, Any]:
+        """Return a private copy of the distro config, loaded only once."""
+        if distro_config not in self._configs:
+            config_path = [self.project.directory] + self.generator.pm_cfg.get_path()
+            sysconfig = load_config(config_path, distro_config)
+            additional_vars = self.generator.load_config_from_project(
+                self.project.directory
+            )
+            self.generator.vars_fill_variables(additional_vars, sysconfig)
+            if "macros" in additional_vars:
+                sysconfig = merge_yaml(sysconfig, {"macros": additional_vars["macros"]})
+            self._configs[distro_config] = sysconfig
+        return copy.deepcopy(self._configs[distro_config])
+
+    def select_spec(self, distro_config: str, version: str) -> Dict[str, Any]:
+        """Return a private copy of the multispec data for the combination."""
+        key = (distro_config, version)
+        if key not in self._specs:
+            self._specs[key] = self.multispec.select_data(
+                [f"version={version}"], distro_config
+            )
+        return copy.deepcopy(self._specs[key])
+
+    def render_spec(self, rendering_kwargs: Dict[str, Any]) -> None:
+        """Render the Jinja expressions in the values of the spec in place.
+
+        Values may refer to other values, so they are rendered again until
+        they stop changing, like distgen does before rendering a template.
+        """
+
+        def render_value(value: Any) -> Tuple[bool, Any]:
+            changed = False
+            if isinstance(value, dict):
+                for k, v in value.items():
+                    item_changed, value[k] = render_value(v)
+                    changed |= item_changed
+            elif isinstance(value, list):
+                for i, v in enumerate(value):
+                    item_changed, value[i] = render_value(v)
+                    changed |= item_changed
+            elif isinstance(value, str):
+                rendered = jinja2.Template(value).render(**rendering_kwargs)
+                return rendered != value, rendered
+            return changed, value
+
+        for _ in range(self.max_passes):
+            changed, _ = render_value(rendering_kwargs["spec"])
+            if not changed:
+                return
+        raise RuntimeError(
+            "Maximum number of rendering passes reached but spec still changing"
+        )
+
+    def render_bytes(
+        self, src: str, distro_config: str, version: str
+    ) -> Optional[bytes]:
+        """Render a template into memory.
+
+        None is returned for a non existing matrix combination, which is
+        what `dg` reports with the exit code 2.
+        """
+        try:
+            spec = self.select_spec(distro_config, version)
+        except MultispecError as e:
+            if e.exit_code == 2:
+                return None
+            raise
+        sysconfig = self.load_distro_config(distro_config)
+
+        self.project.abstract_setup_vars(sysconfig)
+        self.project.inst_init(None, src, sysconfig)
+        projcfg = self.generator.load_config_from_project(self.project.directory)
+        if projcfg and "name" in projcfg:
+            sysconfig["name"] = projcfg["name"]
+        self.generator.vars_fill_variables(sysconfig)
+
+        tpl = self.project.tplgen.get_template(src)
+        self.project.inst_finish(None, src, sysconfig, spec)
+
+        rendering_kwargs = {
+            "config": sysconfig,
+            "macros": sysconfig["macros"],
+            "m": sysconfig["macros"],
+            "container": {"name": "docker"},
+            "spec": spec,
+            "project": self.project,
+            "commands": Commands(self.cmd_cfg, sysconfig),
+            "env": environ,
+        }
+        self.render_spec(rendering_kwargs)
+        rendered: str = tpl.render(**rendering_kwargs)
+        return rendered.encode("utf-8")
+
+    def render(self, src: str, dest: Path, distro_config: str, version: str) -> bool:
+        """Render a template into dest, return False if it failed."""
+        try:
+            content = self.render_bytes(src, distro_config, version)
+        except SystemExit as e:
+            # distgen reports fatal errors by sys.exit()
+            if e.code != 2:
+                print("[ERROR] distgen failed with exit code", e.code)
+                return False
+            return True
+        except Exception as e:
+            print("[ERROR] distgen failed:", e)
+            return False
+        if content is not None:
+            dest.write_bytes(content)
+        return True
+
+
+Renderer = Union[DgRenderer, DistgenRenderer]
+
+
+def get_renderer(engine: str, multispec: Multispec, multispec_path: str) -> Renderer:
+    if engine == "dg":
+        return DgRenderer(multispec_path)
+    return DistgenRenderer(multispec)
+
+
+def load_multispec(multispec_file: TextIO) -> Multispec:
+    multispec_yaml = yaml.load(multispec_file.read(), Loader=yaml.SafeLoader)
+    return Multispec(data=multispec_yaml)
 
 
 def get_version_distro_mapping(
-    multispec_file: TextIO,
+    multispec: Multispec,
 ) -> Dict[str, List[str]]:
     """Get all combinations from multispec file like:
 
@@ -57,8 +259,6 @@ def get_version_distro_mapping(
     {"3.8": ["rhel-8-x86_64.yaml", "centos-stream-10-x86_64.yaml"],
      "3.9": ["rhel-8-x86_64.yaml", "centos-stream-9-x86_64.yaml"]}
     """
-    multispec_yaml = yaml.load(multispec_file.read(), Loader=yaml.SafeLoader)
-    multispec = Multispec(data=multispec_yaml)
     mapping = defaultdict(list)
     for combination in multispec.get_all_combinations():
         mapping[combination["version"]].append(combination["distro"])
@@ -104,16 +304,132 @@ def filename_to_distro_config(
     return config
 
 
+def rule_distro_config(
+    section: str, dest: Path, version: str, mapping: Dict[str, List[str]]
+) -> str:
+    """Distgen distro config used to render a rule, empty if not rendered."""
+    if section == "DISTGEN_RULES":
+        # For common files like README.md or test/run
+        # we need to run distgen only once and it does not
+        # matter which distro config we use.
+        # Sorting is here to make it deterministic.
+        return sorted(mapping[version])[-1]
+    if section == "DISTGEN_MULTI_RULES":
+        return filename_to_distro_config(dest.name, version, mapping)
+    return ""
+
+
+def file_digest(path: Path) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def output_state(dest: Path) -> Optional[str]:
+    """Describe a generated output, None if it does not exist."""
+    if dest.is_symlink():
+        return f"symlink:{readlink(dest)}"
+    if not dest.exists():
+        return None
+    return f"{dest.stat().st_mode & 0o7777:o}:{file_digest(dest)}"
+
+
+def remove_output(dest: Path) -> None:
+    if dest.is_symlink() or dest.exists():
+        unlink(dest)
+
+
+class GenerationCache(object):
+    """Inputs and outputs of the rules generated for a single version.
+
+    Every rule is recorded with a hash of all its inputs (the source file,
+    the multispec, the distro config, the version and the rule itself) and
+    with the state of the output it produced. A rule is up to date when both
+    its inputs and its output are the same as recorded by the previous run.
+
+    Templates included from other templates and the content of distro
+    configs are not tracked, so the cache is only used when asked for.
+    Run with --full to regenerate everything after changing them.
+    """
+
+    def __init__(self, path: Path, multispec_digest: str) -> None:
+        self.path = path
+        self.multispec_digest = multispec_digest
+        try:
+            self.distgen_version = metadata.version("distgen")
+        except metadata.PackageNotFoundError:
+            self.distgen_version = ""
+        self.old_rules: Dict[str, Dict[str, Any]] = {}
+        self.rules: Dict[str, Dict[str, Any]] = {}
+
+    def load(self) -> bool:
+        """Load the previous record, return False if there is none."""
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            self.old_rules = data["rules"]
+        except (OSError, ValueError, KeyError, TypeError):
+            return False
+        return True
+
+    def save(self) -> None:
+        makedirs(self.path.parent, exist_ok=True)
+        with open(self.path, "w") as f:
+            json.dump({"rules": self.rules}, f, indent=1, sort_keys=True)
+
+    def rule_key(
+        self, section: str, spec: Dict[str, Any], distro_config: str, version: str
+    ) -> str:
+        inputs = {
+            "section": section,
+            "rule": {k: str(v) for k, v in spec.items()},
+            "version": version,
+            "distro_config": distro_config,
+        }
+        src = Path(spec["src"])
+        if section != "SYMLINK_RULES":
+            inputs["src"] = file_digest(src) if src.is_file() else ""
+        if section in ("DISTGEN_RULES", "DISTGEN_MULTI_RULES"):
+            inputs["multispec"] = self.multispec_digest
+            inputs["distgen"] = self.distgen_version
+        return hashlib.sha256(
+            json.dumps(inputs, sort_keys=True).encode("utf-8")
+        ).hexdigest()
+
+    def is_fresh(self, dest: Path, key: str) -> bool:
+        old = self.old_rules.get(str(dest))
+        if not old or old["key"] != key or old["output"] != output_state(dest):
+            return False
+        self.rules[str(dest)] = old
+        return True
+
+    def record(self, dest: Path, key: str) -> None:
+        self.rules[str(dest)] = {"key": key, "output": output_state(dest)}
+
+    def forget(self, dest: Path) -> None:
+        self.old_rules.pop(str(dest), None)
+
+    def stale_outputs(self) -> List[Path]:
+        """Outputs of rules that were removed from the manifest."""
+        return [Path(dest) for dest in self.old_rules if dest not in self.rules]
+
+
 def parse_args() -> argparse.Namespace:
     arg_parser = argparse.ArgumentParser(
         description="Helper script for distgen in S2I container images"
     )
-    arg_parser.add_argument(
+    versions_group = arg_parser.add_mutually_exclusive_group(required=True)
+    versions_group.add_argument(
         "-v",
         "--version",
-        dest="version",
-        help="Version of image to generate sources for",
-        required=True,
+        dest="versions",
+        nargs="+",
+        help="Version(s) of image to generate sources for",
+    )
+    versions_group.add_argument(
+        "--all",
+        dest="all",
+        action="store_true",
+        help="Generate sources for all versions defined in the multispec file",
     )
     arg_parser.add_argument(
         "-m",
@@ -131,26 +447,98 @@ def parse_args() -> argparse.Namespace:
         type=argparse.FileType("r"),
         required=True,
     )
+    arg_parser.add_argument(
+        "-e",
+        "--engine",
+        dest="engine",
+        help="How to render distgen templates: in-process through the distgen "
+        "Python API (default), or by running the 'dg' command for every rule",
+        choices=["python", "dg"],
+        default="python",
+    )
+    arg_parser.add_argument(
+        "-j",
+        "--jobs",
+        dest="jobs",
+        help="Number of versions generated in parallel, "
+        "defaults to the number of available CPUs",
+        type=int,
+        default=len(sched_getaffinity(0)),
+    )
+    arg_parser.add_argument(
+        "-c",
+        "--cache-dir",
+        dest="cache_dir",
+        help="Directory where the inputs of generated files are recorded, "
+        "files whose inputs did not change are not generated again "
+        "(by default nothing is cached)",
+    )
+    arg_parser.add_argument(
+        "--full",
+        dest="full",
+        action="store_true",
+        help="Ignore the cache and generate all files again",
+    )
+    arg_parser.add_argument(
+        "--check",
+        dest="check",
+        action="store_true",
+        help="Do not write anything, list the generated files that differ "
+        "from the working tree and exit with 1 if there are any",
+    )
+    arg_parser.add_argument(
+        "--fail-fast",
+        dest="fail_fast",
+        action="store_true",
+        help="With --check, stop at the first difference",
+    )
 
     return arg_parser.parse_args()
 
 
-def main() -> None:
-    args = parse_args()
-    manifest = yaml.load(args.manifest, Loader=yaml.SafeLoader)
-    version_distro_map = get_version_distro_mapping(args.multispec)
-
-    rmtree(args.version, ignore_errors=True)
-    mkdir(args.version)
+def generate_version(
+    version: str,
+    manifest: Dict[str, List[Dict[str, Any]]],
+    version_distro_map: Dict[str, List[str]],
+    renderer: Renderer,
+    cache: Optional[GenerationCache] = None,
+) -> bool:
+    """Generate sources of a single version according to the manifest rules.
+
+    With a cache, only the outputs of rules whose inputs changed are
+    regenerated, otherwise the whole version directory is generated again.
+    Returns False if any of the rules failed.
+    """
+    if cache is not None and cache.load():
+        makedirs(version, exist_ok=True)
+    else:
+        rmtree(version, ignore_errors=True)
+        mkdir(version)
+    up_to_date = 0
+    all_succeeded = True
 
     for section in manifest:
         for spec in manifest[section]:
+            # Do not modify the manifest, it is shared by all versions
+            spec = dict(spec)
             # Prepend {version}/ to all destination paths
-            spec["dest"] = Path(args.version) / spec["dest"]
+            spec["dest"] = Path(version) / spec["dest"]
+
+            distro_config = rule_distro_config(
+                section, spec["dest"], version, version_distro_map
+            )
+
+            if cache is not None:
+                key = cache.rule_key(section, spec, distro_config, version)
+                if cache.is_fresh(spec["dest"], key):
+                    up_to_date += 1
+                    continue
+                remove_output(spec["dest"])
 
             if not spec["dest"].parent.exists():
                 makedirs(spec["dest"].parent)
 
+            success = True
             if section == "COPY_RULES":
                 print(f"CP\t{spec['src']} → {spec['dest']}")
                 copy2(spec["src"], spec["dest"])
@@ -168,39 +556,364 @@ def main() -> None:
 
             elif section == "DISTGEN_RULES":
                 print(f"DG\t{spec['src']} → {spec['dest']}")
-                # For common files like README.md or test/run
-                # we need to run distgen only once and it does not
-                # matter which distro config we use.
-                # Sorting is here to make it deterministic.
-                distro_config = sorted(version_distro_map[args.version])[-1]
-                run_distgen(
-                    spec["src"],
-                    spec["dest"],
-                    args.multispec.name,
-                    distro_config,
-                    args.version,
+                success = renderer.render(
+                    spec["src"], spec["dest"], distro_config, version
                 )
 
             elif section == "DISTGEN_MULTI_RULES":
-                distro_config = filename_to_distro_config(
-                    spec["dest"].name, args.version, version_distro_map
-                )
                 if distro_config:
                     print(f"DGM\t{spec['src']} → {spec['dest']}")
-                    run_distgen(
-                        spec["src"],
-                        spec["dest"],
-                        args.multispec.name,
-                        distro_config,
-                        args.version,
+                    success = renderer.render(
+                        spec["src"], spec["dest"], distro_config, version
                     )
 
             else:
                 print("[WARNING] Unexpected section:", section)
 
-            if "mode" in spec:
+            if not success:
+                all_succeeded = False
+            elif "mode" in spec:
                 chmod(spec["dest"], int(spec["mode"], base=8))
-                pass
+
+            # Failed rules are not recorded, so they are tried again next time
+            if cache is not None:
+                if success:
+                    cache.record(spec["dest"], key)
+                else:
+                    cache.forget(spec["dest"])
+
+    if cache is not None:
+        for dest in cache.stale_outputs():
+            print(f"RM\t{dest}")
+            remove_output(dest)
+            # Remove directories left empty, but never the version directory
+            for parent in dest.parents:
+                if (
+                    parent == Path(version)
+                    or not parent.is_dir()
+                    or any(parent.iterdir())
+                ):
+                    break
+                rmdir(parent)
+        cache.save()
+        print(f"Version {version}: {up_to_date} generated files are up to date.")
+    return all_succeeded
+
+
+def is_executable(mode: int) -> bool:
+    return bool(mode & 0o111)
+
+
+def compare_file(dest: Path, content: Optional[bytes], executable: bool) -> str:
+    """Describe how a file in the working tree differs, empty if it does not.
+
+    None content means the file should not exist. Only the executable bit
+    of the mode is compared, since git does not record the rest.
+    """
+    exists = dest.is_symlink() or dest.exists()
+    if content is None:
+        return "should not exist" if exists else ""
+    if not exists:
+        return "is missing"
+    if dest.is_symlink() or not dest.is_file():
+        return "is not a regular file"
+    if dest.read_bytes() != content:
+        return "content differs"
+    if is_executable(dest.stat().st_mode) != executable:
+        return "should be executable" if executable else "should not be executable"
+    return ""
+
+
+def compare_symlink(dest: Path, target: Optional[str]) -> str:
+    """Describe how a symlink in the working tree differs, empty if it does not.
+
+    None target means the symlink should not exist.
+    """
+    if target is None:
+        return "should not exist" if dest.is_symlink() or dest.exists() else ""
+    if not dest.is_symlink():
+        return "is not a symlink" if dest.exists() else "is missing"
+    if readlink(dest) != target:
+        return f"points to {readlink(dest)}, should point to {target}"
+    return ""
+
+
+def tracked_files(version: str) -> Optional[List[Path]]:
+    """Files of the version tracked by git, None outside of a git repository."""
+    try:
+        output = check_output(["git", "ls-files", "-z", "--", version], stderr=DEVNULL)
+    except (CalledProcessError, OSError):
+        return None
+    return [Path(f) for f in output.decode("utf-8").split("\0") if f]
+
+
+def check_version(
+    version: str,
+    manifest: Dict[str, List[Dict[str, Any]]],
+    version_distro_map: Dict[str, List[str]],
+    renderer: Renderer,
+    fail_fast: bool = False,
+) -> List[str]:
+    """Compare sources of a single version with the working tree.
+
+    All the rules are evaluated in memory, nothing is written. Returns
+    descriptions of the differences, only the first one with fail_fast.
+    Files tracked by git in the version directory, which no rule generates,
+    are differences as well.
+    """
+    differences: List[str] = []
+    generated: List[Path] = []
+    rule_dests: Set[Path] = set()
+
+    def exists_generated(target: Path) -> bool:
+        """Whether a path in the version directory exists after the rules so far."""
+        return any(target == p or target in p.parents for p in generated)
+
+    for section in manifest:
+        for spec in manifest[section]:
+            dest = Path(version) / spec["dest"]
+            distro_config = rule_distro_config(
+                section, dest, version, version_distro_map
+            )
+            mode = int(spec["mode"], base=8) if "mode" in spec else None
+
+            if section == "COPY_RULES":
+                src = Path(spec["src"])
+                content: Optional[bytes] = src.read_bytes()
+                difference = compare_file(
+                    dest, content, is_executable(mode or src.stat().st_mode)
+                )
+
+            elif section == "SYMLINK_RULES":
+                target: Optional[str] = spec["src"]
+                resolved = Path(normpath(dest.parent / spec["src"]))
+                # The version directory is generated from scratch, so only
+                # the files generated before the link can be its target
+                if Path(version) in resolved.parents:
+                    target_exists = exists_generated(resolved)
+                else:
+                    target_exists = resolved.exists()
+                if spec.get("check_symlink", True) and not target_exists:
+                    target = None
+                difference = compare_symlink(dest, target)
+                content = b"" if target is not None else None
+
+            elif section in ("DISTGEN_RULES", "DISTGEN_MULTI_RULES"):
+                content = None
+                if distro_config:
+                    try:
+                        content = renderer.render_bytes(
+                            spec["src"], distro_config, version
+                        )
+                    except SystemExit as e:
+                        # distgen reports fatal errors by sys.exit()
+                        if e.code != 2:
+                            raise RuntimeError(
+                                f"distgen failed with exit code {e.code}"
+                            ) from e
+                difference = compare_file(dest, content, is_executable(mode or 0))
+
+            else:
+                print("[WARNING] Unexpected section:", section)
+                continue
+
+            rule_dests.add(dest)
+            if content is not None:
+                generated.append(dest)
+            if difference:
+                differences.append(f"{dest}: {difference}")
+                if fail_fast:
+                    return differences
+
+    for tracked in tracked_files(version) or []:
+        if tracked not in rule_dests:
+            differences.append(f"{tracked}: is not generated by any rule")
+            if fail_fast:
+                break
+    return differences
+
+
+# Renderer of a worker process used by generate_versions_parallel, the distgen
+# project and Jinja environment cannot be passed between processes
+_worker_renderer: Optional[Renderer] = None
+
+
+def _init_worker(engine: str, multispec: Multispec, multispec_path: str) -> None:
+    global _worker_renderer
+    _worker_renderer = get_renderer(engine, multispec, multispec_path)
+
+
+def _generate_version_buffered(
+    version: str,
+    manifest: Dict[str, List[Dict[str, Any]]],
+    version_distro_map: Dict[str, List[str]],
+    cache: Optional[GenerationCache],
+) -> Tuple[bool, str]:
+    """Generate a version in a worker process and return its status and log."""
+    assert _worker_renderer is not None
+    log = io.StringIO()
+    success = True
+    with redirect_stdout(log), redirect_stderr(log):
+        try:
+            success = generate_version(
+                version, manifest, version_distro_map, _worker_renderer, cache
+            )
+        except Exception:
+            print(f"[ERROR] Generating version {version} failed:")
+            print(traceback.format_exc(), end="")
+            success = False
+    return success, log.getvalue()
+
+
+def _check_version_buffered(
+    version: str,
+    manifest: Dict[str, List[Dict[str, Any]]],
+    version_distro_map: Dict[str, List[str]],
+    fail_fast: bool,
+) -> List[str]:
+    """Check a version in a worker process and return its differences."""
+    assert _worker_renderer is not None
+    with redirect_stdout(io.StringIO()):
+        return check_version(
+            version, manifest, version_distro_map, _worker_renderer, fail_fast
+        )
+
+
+def check_versions(
+    versions: List[str],
+    manifest: Dict[str, List[Dict[str, Any]]],
+    version_distro_map: Dict[str, List[str]],
+    args: argparse.Namespace,
+    multispec: Multispec,
+) -> int:
+    """Compare sources of the versions with the working tree.
+
+    The versions are checked in a pool of processes, unless the check stops
+    at the first difference. Returns the number of differences.
+    """
+    differences: List[str] = []
+    if len(versions) > 1 and args.jobs > 1 and not args.fail_fast:
+        with ProcessPoolExecutor(
+            max_workers=min(args.jobs, len(versions)),
+            initializer=_init_worker,
+            initargs=(args.engine, multispec, args.multispec.name),
+        ) as executor:
+            futures = [
+                executor.submit(
+                    _check_version_buffered,
+                    version,
+                    manifest,
+                    version_distro_map,
+                    args.fail_fast,
+                )
+                for version in versions
+            ]
+            for future in futures:
+                differences.extend(future.result())
+    else:
+        renderer = get_renderer(args.engine, multispec, args.multispec.name)
+        for version in versions:
+            differences.extend(
+                check_version(
+                    version, manifest, version_distro_map, renderer, args.fail_fast
+                )
+            )
+            if differences and args.fail_fast:
+                break
+
+    for difference in differences:
+        print(f"DIFF\t{difference}")
+    if differences:
+        print(
+            f"[ERROR] {len(differences)} generated files differ from the working tree."
+        )
+    else:
+        print(f"Generated files of versions {' '.join(versions)} are up to date.")
+    return len(differences)
+
+
+def generate_versions_parallel(
+    versions: List[str],
+    manifest: Dict[str, List[Dict[str, Any]]],
+    version_distro_map: Dict[str, List[str]],
+    args: argparse.Namespace,
+    multispec: Multispec,
+    caches: Dict[str, Optional[GenerationCache]],
+) -> List[str]:
+    """Generate several versions concurrently in a pool of processes.
+
+    Logs of the versions are buffered and printed in the order the versions
+    were given, so the output is the same as from the serial run.
+    Returns the versions that failed.
+    """
+    failed = []
+    with ProcessPoolExecutor(
+        max_workers=min(args.jobs, len(versions)),
+        initializer=_init_worker,
+        initargs=(args.engine, multispec, args.multispec.name),
+    ) as executor:
+        futures = [
+            executor.submit(
+                _generate_version_buffered,
+                version,
+                manifest,
+                version_distro_map,
+                caches[version],
+            )
+            for version in versions
+        ]
+        for version, future in zip(versions, futures):
+            success, log = future.result()
+            print(f"==> Version {version}")
+            print(log, end="", flush=True)
+            if not success:
+                failed.append(version)
+    return failed
+
+
+def main() -> None:
+    args = parse_args()
+    manifest = yaml.load(args.manifest, Loader=yaml.SafeLoader)
+    multispec = load_multispec(args.multispec)
+    version_distro_map = get_version_distro_mapping(multispec)
+
+    if args.all:
+        versions = list(multispec.get_spec_group("version"))
+    else:
+        versions = args.versions
+
+    if args.check:
+        differences = check_versions(
+            versions, manifest, version_distro_map, args, multispec
+        )
+        sys.exit(1 if differences else 0)
+
+    caches: Dict[str, Optional[GenerationCache]] = {}
+    multispec_digest = file_digest(Path(args.multispec.name))
+    for version in versions:
+        caches[version] = None
+        if args.cache_dir:
+            cache_file = Path(args.cache_dir) / f"{version}.json"
+            if args.full and cache_file.exists():
+                unlink(cache_file)
+            caches[version] = GenerationCache(cache_file, multispec_digest)
+
+    if len(versions) > 1 and args.jobs > 1:
+        failed = generate_versions_parallel(
+            versions, manifest, version_distro_map, args, multispec, caches
+        )
+    else:
+        failed = []
+        renderer = get_renderer(args.engine, multispec, args.multispec.name)
+        for version in versions:
+            if not generate_version(
+                version, manifest, version_distro_map, renderer, caches[version]
+            ):
+                failed.append(version)
+
+    if failed:
+        print("[ERROR] Generating sources failed for versions:", " ".join(failed))
+    sys.exit(1 if failed else 0)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,55 @@
+# Timing metrics for build.sh, test.sh and test-lib.sh
+
+# shellcheck disable=SC2148
+if [ -z "${sourced_metrics_lib:-}" ]; then
+  sourced_metrics_lib=1
+else
+  return 0
+fi
+
+# Timing metrics are appended to $METRICS_FILE as JSON lines, if it is set.
+# The path is made absolute, since the scripts change directories.
+if [ -n "${METRICS_FILE:-}" ]; then
+  METRICS_FILE=$(realpath -m "$METRICS_FILE")
+  export METRICS_FILE
+fi
+
+# metrics_timestamp
+# -----------------------------
+# Prints the current time in seconds since unix era, with a fraction.
+metrics_timestamp() {
+  echo "${EPOCHREALTIME:-$(date '+%s.%N')}"
+}
+
+# record_metric PHASE VERSION START_TIME [EXIT_CODE] [KEY=VALUE ...]
+# -----------------------------
+# Appends a JSON line describing a finished phase to $METRICS_FILE, e.g.
+# {"timestamp": 1700000060.5, "script": "build.sh", "os": "rhel9",
+#  "version": "3.12", "phase": "pull", "duration": 60.2, "exit_code": 0}
+# Additional KEY=VALUE pairs are added as string fields.
+# Does nothing if METRICS_FILE is not set.
+# Argument: VERSION - version the phase belongs to, empty for all versions
+# Argument: START_TIME - time when the phase started, from metrics_timestamp
+record_metric() {
+  [ -n "${METRICS_FILE:-}" ] || return 0
+  local phase="$1"
+  local version="$2"
+  local time_beg="$3"
+  local exit_code="${4:-0}"
+  local time_end
+  local fields=""
+  local field
+  local value
+  shift 4 || shift $#
+  time_end=$(metrics_timestamp)
+  for field in "$@"; do
+    value="${field#*=}"
+    value="${value//\\/\\\\}"
+    value="${value//\"/\\\"}"
+    fields+=", \"${field%%=*}\": \"${value}\""
+  done
+  printf '{"timestamp": %s, "script": "%s", "os": "%s", "version": "%s", "phase": "%s", "duration": %s, "exit_code": %s%s}\n' \
+    "$time_end" "$(basename "$0")" "${OS:-}" "$version" "$phase" \
+    "$(awk -v beg="$time_beg" -v end="$time_end" 'BEGIN { printf "%.3f", end - beg }')" \
+    "$exit_code" "$fields" >> "$METRICS_FILE"
+}
@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2026 Red Hat, Inc.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Check that images exist in their registries and print their digests, using
+HEAD requests for the manifests (registry HTTP API v2) instead of pulling them.
+
+Every line of the output is "<image>\t<status>\t<digest>", where the status is
+'available', 'missing', 'unauthorized' or 'error'. Connections to a registry
+are reused and answers can be cached in a file shared by several runs.
+
+Usage:
+    registry_probe.py quay.io/sclorg/postgresql-15-c9s:c9s ...
+"""
+
+import argparse
+import base64
+import hashlib
+import http.client
+import json
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+DEFAULT_REGISTRY: str = "docker.io"
+REGISTRY_HOSTS: Dict[str, str] = {"docker.io": "registry-1.docker.io"}
+
+MANIFEST_TYPES: str = ", ".join(
+    [
+        "application/vnd.oci.image.index.v1+json",
+        "application/vnd.docker.distribution.manifest.list.v2+json",
+        "application/vnd.oci.image.manifest.v1+json",
+        "application/vnd.docker.distribution.manifest.v2+json",
+    ]
+)
+
+# Statuses that are cached. Errors are tried again by the next run, and so are
+# refused images, which may be available after logging in to the registry.
+FINAL_STATUSES = ("available", "missing")
+
+challenge_regex = re.compile(r'(\w+)="([^"]*)"')
+
+
+class ProbeError(Exception):
+    pass
+
+
+def parse_reference(image: str) -> Tuple[str, str, str]:
+    """Registry, repository and tag or digest of an image reference."""
+    name, _, digest = image.partition("@")
+    registry, _, rest = name.partition("/")
+    if not rest or not ("." in registry or ":" in registry or registry == "localhost"):
+        registry, rest = DEFAULT_REGISTRY, name
+    if registry == DEFAULT_REGISTRY and "/" not in rest:
+        rest = f"library/{rest}"
+    repository, tag = rest, "latest"
+    if ":" in rest.rsplit("/", 1)[-1]:
+        repository, tag = rest.rsplit(":", 1)
+    return registry, repository, digest or tag
+
+
+def is_insecure(registry: str, insecure: List[str]) -> bool:
+    """Registries on the loopback and the listed ones are used over plain HTTP."""
+    host = registry.rsplit(":", 1)[0] if not registry.endswith("]") else registry
+    return registry in insecure or host in ("localhost", "127.0.0.1", "[::1]")
+
+
+def auth_files() -> List[str]:
+    """Podman and docker auth files, in the order podman looks for them."""
+    paths = [os.environ.get("REGISTRY_AUTH_FILE", "")]
+    if os.environ.get("XDG_RUNTIME_DIR"):
+        paths.append(
+            os.path.join(os.environ["XDG_RUNTIME_DIR"], "containers/auth.json")
+        )
+    # The default of podman run by root, without XDG_RUNTIME_DIR
+    paths.append(f"/run/containers/{os.getuid()}/auth.json")
+    paths.append(os.path.expanduser("~/.config/containers/auth.json"))
+    docker_config = os.environ.get("DOCKER_CONFIG") or os.path.expanduser("~/.docker")
+    paths.append(os.path.join(docker_config, "config.json"))
+    return [path for path in paths if path]
+
+
+def registry_name(key: str) -> str:
+    """Registry of a key in the auth files, which may be an URL."""
+    registry = re.sub(r"^https?://|/.*$", "", key)
+    return DEFAULT_REGISTRY if registry == "index.docker.io" else registry
+
+
+class Credentials(object):
+    """Credentials of registries from the auth files and docker credential helpers."""
+
+    def __init__(self, paths: List[str]):
+        self.credentials: Dict[str, Optional[Tuple[str, str]]] = {}
+        # docker credential helpers by registry and the default one
+        self.helpers: Dict[str, str] = {}
+        self.store = ""
+        self.lock = threading.Lock()
+        for path in paths:
+            try:
+                with open(path) as f:
+                    config = json.load(f)
+                auths = config.get("auths", {})
+                helpers = config.get("credHelpers", {})
+                store = config.get("credsStore", "")
+            except (OSError, ValueError, AttributeError):
+                continue
+            for key, value in auths.items():
+                try:
+                    user, _, password = (
+                        base64.b64decode(value["auth"]).decode().partition(":")
+                    )
+                except (KeyError, TypeError, ValueError):
+                    continue
+                self.credentials.setdefault(registry_name(key), (user, password))
+            for key, helper in helpers.items():
+                self.helpers.setdefault(registry_name(key), helper)
+            self.store = self.store or store
+
+    def get(self, registry: str) -> Optional[Tuple[str, str]]:
+        with self.lock:
+            if registry not in self.credentials:
+                helper = self.helpers.get(registry, self.store)
+                self.credentials[registry] = (
+                    self.from_helper(helper, registry) if helper else None
+                )
+            return self.credentials[registry]
+
+    @staticmethod
+    def from_helper(helper: str, registry: str) -> Optional[Tuple[str, str]]:
+        """Credentials of the registry kept by a docker credential helper."""
+        server = (
+            "https://index.docker.io/v1/" if registry == DEFAULT_REGISTRY else registry
+        )
+        try:
+            result = subprocess.run(
+                [f"docker-credential-{helper}", "get"],
+                input=server,
+                capture_output=True,
+                text=True,
+                timeout=30,
+            )
+            if result.returncode != 0:
+                return None
+            data = json.loads(result.stdout)
+            return str(data["Username"]), str(data["Secret"])
+        except (OSError, ValueError, KeyError, TypeError, subprocess.SubprocessError):
+            return None
+
+
+class ProbeCache(object):
+    """Answers for image references, appended to a file by all the runs."""
+
+    def __init__(self, path: Optional[str]):
+        self.path = path
+        self.results: Dict[str, Tuple[str, str]] = {}
+        if not path:
+            return
+        try:
+            with open(path) as f:
+                for line in f:
+                    fields = line.rstrip("\n").split("\t")
+                    if len(fields) == 3:
+                        self.results[fields[0]] = (fields[1], fields[2])
+        except OSError:
+            pass
+
+    def get(self, image: str) -> Optional[Tuple[str, str]]:
+        return self.results.get(image)
+
+    def add(self, image: str, status: str, digest: str) -> None:
+        self.results[image] = (status, digest)
+        if not self.path or status not in FINAL_STATUSES:
+            return
+        # A single write of a short line to a file opened for appending does
+        # not interleave with the lines of other runs
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, f"{image}\t{status}\t{digest}\n".encode())
+        finally:
+            os.close(fd)
+
+
+class RegistryProbe(object):
+    def __init__(
+        self,
+        insecure: Optional[List[str]] = None,
+        retries: int = 3,
+        retry_delay: float = 1.0,
+        timeout: float = 30.0,
+    ):
+        self.insecure = insecure or []
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.timeout = timeout
+        self.credentials = Credentials(auth_files())
+        # Bearer tokens by realm, service and scope
+        self.tokens: Dict[Tuple[str, str, str], str] = {}
+        # Authorization headers by registry and repository, sent right away
+        self.authorizations: Dict[Tuple[str, str], Dict[str, str]] = {}
+        self.tokens_lock = threading.Lock()
+        # Open connections of every thread, by scheme and host
+        self.local = threading.local()
+
+    def connection(self, scheme: str, host: str) -> http.client.HTTPConnection:
+        connections: Dict[Tuple[str, str], http.client.HTTPConnection]
+        connections = getattr(self.local, "connections", {})
+        self.local.connections = connections
+        conn = connections.get((scheme, host))
+        if conn is None:
+            if scheme == "https":
+                conn = http.client.HTTPSConnection(host, timeout=self.timeout)
+            else:
+                conn = http.client.HTTPConnection(host, timeout=self.timeout)
+            connections[(scheme, host)] = conn
+        return conn
+
+    def request(
+        self, method: str, url: str, headers: Dict[str, str]
+    ) -> Tuple[int, http.client.HTTPMessage, bytes]:
+        parsed = urllib.parse.urlsplit(url)
+        path = parsed.path + (f"?{parsed.query}" if parsed.query else "")
+        # A kept-alive connection may have been closed by the registry meanwhile
+        for attempt in range(2):
+            conn = self.connection(parsed.scheme, parsed.netloc)
+            try:
+                conn.request(method, path, headers=headers)
+                response = conn.getresponse()
+                body = response.read()
+            except (http.client.HTTPException, OSError):
+                conn.close()
+                if attempt:
+                    raise
+                continue
+            if response.getheader("Connection", "").lower() == "close":
+                conn.close()
+            return response.status, response.headers, body
+        raise ProbeError(f"no response from {parsed.netloc}")
+
+    def basic_auth(self, registry: str) -> Dict[str, str]:
+        credentials = self.credentials.get(registry)
+        if credentials is None:
+            return {}
+        user, password = credentials
+        encoded = base64.b64encode(f"{user}:{password}".encode()).decode()
+        return {"Authorization": f"Basic {encoded}"}
+
+    def token(self, registry: str, challenge: str) -> Dict[str, str]:
+        """Authorization answering the WWW-Authenticate challenge of the registry."""
+        if challenge.lower().startswith("basic"):
+            return self.basic_auth(registry)
+        params = dict(challenge_regex.findall(challenge))
+        realm = params.get("realm", "")
+        key = (realm, params.get("service", ""), params.get("scope", ""))
+        with self.tokens_lock:
+            token = self.tokens.get(key)
+        if token is None:
+            query = urllib.parse.urlencode(
+                {k: v for k, v in params.items() if k in ("service", "scope")}
+            )
+            status, _, body = self.request(
+                "GET", f"{realm}?{query}", self.basic_auth(registry)
+            )
+            if status != 200:
+                return {}
+            data = json.loads(body)
+            token = str(data.get("token") or data.get("access_token") or "")
+            with self.tokens_lock:
+                self.tokens[key] = token
+        return {"Authorization": f"Bearer {token}"}
+
+    def probe_once(self, image: str) -> Tuple[str, str]:
+        registry, repository, reference = parse_reference(image)
+        scheme = "http" if is_insecure(registry, self.insecure) else "https"
+        host = REGISTRY_HOSTS.get(registry, registry)
+        url = f"{scheme}://{host}/v2/{repository}/manifests/{reference}"
+        with self.tokens_lock:
+            authorization = self.authorizations.get((registry, repository), {})
+        headers = {"Accept": MANIFEST_TYPES, **authorization}
+        status, response_headers, _ = self.request("HEAD", url, headers)
+        challenge = response_headers.get("WWW-Authenticate", "")
+        if status == 401 and challenge:
+            authorization = self.token(registry, challenge)
+            with self.tokens_lock:
+                self.authorizations[(registry, repository)] = authorization
+            headers.update(authorization)
+            status, response_headers, _ = self.request("HEAD", url, headers)
+        if status == 200:
+            digest = response_headers.get("Docker-Content-Digest", "")
+            if not digest:
+                # Not every registry sends the digest for HEAD requests
+                status, _, body = self.request("GET", url, headers)
+                digest = f"sha256:{hashlib.sha256(body).hexdigest()}"
+            return "available", digest
+        if status == 404:
+            return "missing", ""
+        if status in (401, 403):
+            return "unauthorized", ""
+        raise ProbeError(f"HTTP {status} from {host}")
+
+    def probe(self, image: str) -> Tuple[str, str]:
+        """Status and digest of the image, transient failures are tried again."""
+        error = ""
+        for attempt in range(self.retries + 1):
+            try:
+                return self.probe_once(image)
+            except (ProbeError, http.client.HTTPException, OSError, ValueError) as e:
+                error = str(e) or type(e).__name__
+            if attempt < self.retries:
+                time.sleep(self.retry_delay * 2**attempt)
+        print(f"{image}: {error}", file=sys.stderr)
+        return "error", ""
+
+    def probe_all(
+        self, images: List[str], cache: ProbeCache, jobs: Optional[int] = None
+    ) -> Dict[str, Tuple[str, str]]:
+        results: Dict[str, Tuple[str, str]] = {}
+        pending = []
+        for image in dict.fromkeys(images):
+            cached = cache.get(image)
+            if cached is not None:
+                results[image] = cached
+            else:
+                pending.append(image)
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            for image, (status, digest) in zip(
+                pending, executor.map(self.probe, pending)
+            ):
+                cache.add(image, status, digest)
+                results[image] = (status, digest)
+        return results
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Check that images are available in their registries "
+        "without pulling them and print their digests."
+    )
+    parser.add_argument("images", nargs="+", metavar="IMAGE")
+    parser.add_argument(
+        "-c", "--cache", help="File with answers of previous runs, appended to"
+    )
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=8, help="Number of images checked at once"
+    )
+    parser.add_argument(
+        "--insecure",
+        action="append",
+        default=os.environ.get("CT_INSECURE_REGISTRIES", "").split(),
+        metavar="REGISTRY",
+        help="Registry to access over plain HTTP (default: $CT_INSECURE_REGISTRIES)",
+    )
+    parser.add_argument(
+        "--retries", type=int, default=3, help="Retries of transient failures"
+    )
+    parser.add_argument(
+        "--retry-delay",
+        type=float,
+        default=1.0,
+        help="Delay before the first retry in seconds, doubled by each retry",
+    )
+    args = parser.parse_args()
+
+    probe = RegistryProbe(args.insecure, args.retries, args.retry_delay)
+    results = probe.probe_all(args.images, ProbeCache(args.cache), args.jobs)
+    for image in args.images:
+        status, digest = results[image]
+        print(f"{image}\t{status}\t{digest}")
+    return 0 if all(s == "available" for s, _ in results.values()) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2026 Red Hat, Inc.
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Model of a container repository: VERSIONS from the Makefile and, for every
+version, the distros it has a Dockerfile for and its .exclude-<OS>,
+.devel-repo-<OS> and .build-args-<OS> marker files.
+
+The model is cached in .repo-model.json in the repository and scanned again
+only when the Makefile, a version directory or a build-args file changes.
+
+Usage:
+    repo_model.py                       # the model as JSON
+    repo_model.py --os rhel9 -f shell   # variables for the OS, for eval in shell
+"""
+
+import argparse
+import json
+import os
+import re
+import shlex
+import sys
+
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+CACHE_FILE: str = ".repo-model.json"
+CACHE_FORMAT: int = 1
+
+# VERSIONS assigned by =, :=, ::=, ?= or appended to by +=
+version_regex = re.compile(
+    r"^(?:(?:export|override)\s+)*VERSIONS\s*(?P<op>::?|\?|\+)?=\s*(?P<value>.*)$"
+)
+marker_regex = re.compile(
+    r"^(?:Dockerfile\.(?P<dockerfile>.+)"
+    r"|\.exclude-(?P<exclude>.+)"
+    r"|\.devel-repo-(?P<devel_repo>.+)"
+    r"|\.build-args-(?P<build_args>.+))$"
+)
+
+
+class RepoModelError(Exception):
+    pass
+
+
+def makefile_lines(makefile: Path) -> Iterable[str]:
+    """Lines of the Makefile, with continued lines joined and comments removed."""
+    logical = ""
+    with open(makefile) as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if line.endswith("\\"):
+                logical += line[:-1] + " "
+                continue
+            yield (logical + line).split("#", 1)[0].strip()
+            logical = ""
+    if logical:
+        yield logical.split("#", 1)[0].strip()
+
+
+def read_makefile_versions(repo_dir: Path) -> List[str]:
+    """Versions from the VERSIONS variable in the Makefile.
+
+    Raises RepoModelError if the Makefile does not assign VERSIONS or its
+    value depends on other make variables or functions.
+    """
+    makefile = repo_dir / "Makefile"
+    if not makefile.exists():
+        return []
+    versions: Optional[List[str]] = None
+    for line in makefile_lines(makefile):
+        match = version_regex.match(line)
+        if not match:
+            continue
+        if "$" in match["value"]:
+            raise RepoModelError(
+                f"VERSIONS in {makefile} cannot be evaluated without make: {line}"
+            )
+        if match["op"] == "+":
+            versions = (versions or []) + match["value"].split()
+        elif match["op"] != "?" or versions is None:
+            versions = match["value"].split()
+    if versions is None:
+        raise RepoModelError(f"VERSIONS is not set in {makefile}")
+    return versions
+
+
+def scan_version(version_dir: Path) -> Dict[str, Any]:
+    """Dockerfile distros and marker files of a single version directory."""
+    info: Dict[str, Any] = {
+        "distros": [],
+        "excludes": [],
+        "devel_repos": [],
+        "build_args": {},
+    }
+    if not version_dir.is_dir():
+        return info
+    for name in sorted(os.listdir(version_dir)):
+        match = marker_regex.match(name)
+        if not match:
+            continue
+        if match["dockerfile"]:
+            info["distros"].append(match["dockerfile"])
+        elif match["exclude"]:
+            info["excludes"].append(match["exclude"])
+        elif match["devel_repo"]:
+            info["devel_repos"].append(match["devel_repo"])
+        elif match["build_args"]:
+            info["build_args"][match["build_args"]] = (version_dir / name).read_text()
+    return info
+
+
+def mtime(path: Path) -> Optional[int]:
+    try:
+        return path.stat().st_mtime_ns
+    except OSError:
+        return None
+
+
+class RepoModel(object):
+    def __init__(
+        self,
+        repo_dir: Path,
+        versions: List[str],
+        version_info: Dict[str, Dict[str, Any]],
+    ):
+        self.repo_dir = repo_dir
+        # Versions from the Makefile
+        self.versions = versions
+        # All scanned versions, i.e. also versions requested by the caller
+        self.version_info = version_info
+
+    @classmethod
+    def scan(cls, repo_dir: Path, extra_versions: Iterable[str] = ()) -> "RepoModel":
+        versions = read_makefile_versions(repo_dir)
+        scanned = list(dict.fromkeys(versions + list(extra_versions)))
+        return cls(repo_dir, versions, {v: scan_version(repo_dir / v) for v in scanned})
+
+    @classmethod
+    def load(
+        cls,
+        repo_dir: Path = Path("."),
+        extra_versions: Iterable[str] = (),
+        use_cache: bool = True,
+    ) -> "RepoModel":
+        """Load the model from the cache if it is up to date, scan the repository otherwise."""
+        extra_versions = list(extra_versions)
+        cache_path = repo_dir / CACHE_FILE
+        if use_cache:
+            try:
+                with open(cache_path) as f:
+                    cache = json.load(f)
+                model = cls(repo_dir, cache["versions"], cache["version_info"])
+                if (
+                    cache.get("format") == CACHE_FORMAT
+                    and set(extra_versions) <= model.version_info.keys()
+                    and cache["fingerprint"] == model.fingerprint()
+                ):
+                    return model
+            except (OSError, ValueError, KeyError, TypeError):
+                pass
+        model = cls.scan(repo_dir, extra_versions)
+        if use_cache:
+            model.save(cache_path)
+        return model
+
+    def fingerprint(self) -> Dict[str, Optional[int]]:
+        """Modification times of everything the model was derived from."""
+        paths = [Path("Makefile")]
+        for version, info in self.version_info.items():
+            paths.append(Path(version))
+            paths.extend(
+                Path(version) / f".build-args-{os_name}"
+                for os_name in info["build_args"]
+            )
+        return {str(p): mtime(self.repo_dir / p) for p in paths}
+
+    def save(self, cache_path: Path) -> None:
+        cache = {
+            "format": CACHE_FORMAT,
+            "versions": self.versions,
+            "version_info": self.version_info,
+            "fingerprint": self.fingerprint(),
+        }
+        tmp_path = cache_path.with_name(f"{cache_path.name}.{os.getpid()}")
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(cache, f)
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            # The model works without the cache, e.g. in a read-only checkout
+            pass
+
+    def distros(self, version: str) -> List[str]:
+        return list(self.version_info[version]["distros"])
+
+    def is_excluded(self, version: str, os_name: str) -> bool:
+        return os_name in self.version_info[version]["excludes"]
+
+    def versions_with(self, key: str, os_name: str) -> List[str]:
+        return [v for v, info in self.version_info.items() if os_name in info[key]]
+
+    def latest_version(self, os_name: str) -> str:
+        """The last version from the Makefile, which is not excluded for the OS."""
+        for version in reversed(self.versions):
+            if not self.is_excluded(version, os_name):
+                return version
+        return ""
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"versions": self.versions, "version_info": self.version_info}
+
+    def to_shell(self, os_name: Optional[str] = None) -> str:
+        """Variables describing the repository, to be evaluated by shell."""
+        variables = {"REPO_VERSIONS": " ".join(self.versions)}
+        if os_name:
+            variables.update(
+                {
+                    "REPO_DOCKERFILE_VERSIONS": " ".join(
+                        self.versions_with("distros", os_name)
+                    ),
+                    "REPO_EXCLUDED_VERSIONS": " ".join(
+                        self.versions_with("excludes", os_name)
+                    ),
+                    "REPO_DEVEL_REPO_VERSIONS": " ".join(
+                        self.versions_with("devel_repos", os_name)
+                    ),
+                    "REPO_BUILD_ARGS_VERSIONS": " ".join(
+                        self.versions_with("build_args", os_name)
+                    ),
+                    "REPO_LATEST_VERSION": self.latest_version(os_name),
+                }
+            )
+        return "".join(f"{k}={shlex.quote(v)}\n" for k, v in variables.items())
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Print the versions, distros and marker files of a container repository."
+    )
+    parser.add_argument(
+        "versions",
+        nargs="*",
+        metavar="VERSION",
+        help="Versions to scan in addition to VERSIONS from the Makefile",
+    )
+    parser.add_argument(
+        "-C", "--directory", default=".", help="Repository directory (default: .)"
+    )
+    parser.add_argument(
+        "-f",
+        "--format",
+        choices=["json", "shell"],
+        default="json",
+        help="Output format",
+    )
+    parser.add_argument("--os", help="Add shell variables for this OS, e.g. rhel9")
+    parser.add_argument(
+        "--no-cache", action="store_true", help=f"Do not use {CACHE_FILE}"
+    )
+    args = parser.parse_args()
+
+    try:
+        model = RepoModel.load(
+            Path(args.directory), args.versions, use_cache=not args.no_cache
+        )
+    except RepoModelError as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return 1
+    if args.format == "shell":
+        sys.stdout.write(model.to_shell(args.os))
+    else:
+        print(json.dumps(model.to_dict(), indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -19,9 +19,18 @@ fi
 
 LINE="=============================================="
 
+# record_metric, shared with build.sh and test.sh
+# shellcheck source=/dev/null
+source "$(dirname "$(readlink -f "${BASH_SOURCE[0]}")")"/metrics.sh
+
 # may be redefined in the specific container testfile
 EXPECTED_EXIT_CODE=0
 
+# App images reused by ct_build_image_and_parse_id if CT_APP_IMAGE_CACHE is set
+CT_APP_IMAGE_CACHE_DIR=${CT_APP_IMAGE_CACHE_DIR:-${XDG_CACHE_HOME:-$HOME/.cache}/container-common-scripts/app-images}
+CT_APP_IMAGE_CACHE_REPO=ct-app-cache
+CT_APP_IMAGE_CACHE_LABEL=io.sclorg.test-app-cache-key
+
 # define UNSTABLE_TESTS if not already defined, as this variable
 # is not mandatory for containers
 UNSTABLE_TESTS="${UNSTABLE_TESTS:-""}"
@@ -35,9 +44,15 @@ UNSTABLE_TESTS="${UNSTABLE_TESTS:-""}"
 # Sets: $CID_FILE_DIR - path to directory containing cid_files
 # Sets: $TEST_SUMMARY - string, where test results are written
 # Sets: $TESTSUITE_RESULT - overall result of run testuite
+# Sets: $CT_IMAGE_SIZE_CACHE_DIR - path to directory caching image sizes,
+# unless it is set already
 function ct_init() {
   APP_ID_FILE_DIR="$(mktemp -d)"
   CID_FILE_DIR="$(mktemp -d)"
+  if [ -z "${CT_IMAGE_SIZE_CACHE_DIR:-}" ]; then
+    CT_IMAGE_SIZE_CACHE_DIR="$(mktemp -d)"
+    CT_IMAGE_SIZE_CACHE_DIR_CREATED=1
+  fi
   TEST_SUMMARY=""
   TESTSUITE_RESULT=0
   ct_enable_cleanup
@@ -47,7 +62,8 @@ function ct_init() {
 # --------------------
 # Cleans up containers used during tests. Stops and removes all containers
 # referenced by cid_files in CID_FILE_DIR. Dumps logs if a container exited
-# unexpectedly. Removes the cid_files and CID_FILE_DIR as well.
+# unexpectedly. Removes the cid_files and CID_FILE_DIR as well, and the
+# CT_IMAGE_SIZE_CACHE_DIR if ct_init created it.
 # Uses: $CID_FILE_DIR - path to directory containing cid_files
 # Uses: $EXPECTED_EXIT_CODE - expected container exit code
 # Uses: $TESTSUITE_RESULT - overall result of all tests
@@ -58,11 +74,22 @@ function ct_cleanup() {
   echo "$LINE"
   ct_clean_app_images
   ct_clean_containers
+  if [ -n "${CT_REGISTRY_PROBE_CACHE_CREATED:-}" ]; then
+    rm -f "$CT_REGISTRY_PROBE_CACHE"
+    unset CT_REGISTRY_PROBE_CACHE CT_REGISTRY_PROBE_CACHE_CREATED
+  fi
+  if [ -n "${CT_IMAGE_SIZE_CACHE_DIR_CREATED:-}" ]; then
+    rm -rf "$CT_IMAGE_SIZE_CACHE_DIR"
+    unset CT_IMAGE_SIZE_CACHE_DIR CT_IMAGE_SIZE_CACHE_DIR_CREATED
+  fi
 }
 
 # ct_build_image_and_parse_id
 # --------------------
 # Return 0 if build was successful, 1 otherwise
+# Images are built with --no-cache, unless $CT_APP_IMAGE_CACHE is set. Then the
+# layer cache is used and an image built before from the same base images,
+# Dockerfile, build params and files in the context is reused without a build.
 # Uses: $1 - path to docckerfile
 # Uses: $2 - build params
 # Uses: $APP_IMAGE_ID - sets the app image id value to this variable
@@ -75,21 +102,143 @@ ct_build_image_and_parse_id() {
   local dockerfile
   local command
   local sleep_time
+  local cache_key=
+  local cache_options="--no-cache"
+  if [ -n "${CT_APP_IMAGE_CACHE:-}" ]; then
+    cache_key=$(ct_app_image_cache_key "$1" "$2") || cache_key=
+  fi
+  if [ -n "$cache_key" ]; then
+    ct_app_image_cache_reuse "$cache_key" "$2" && return 0
+    cache_options="--label $CT_APP_IMAGE_CACHE_LABEL=$cache_key -t $CT_APP_IMAGE_CACHE_REPO:${cache_key:0:16}"
+  fi
   log_file="$(mktemp)"
   sleep_time="10m"
   [ -n "$1" ] && dockerfile="-f $1"
-  command="$(echo "docker build --no-cache $dockerfile $2" | tr -d "'")"
+  command="$(echo "docker build $cache_options $dockerfile $2" | tr -d "'")"
   # shellcheck disable=SC2086
   timeout $sleep_time $command > "$log_file" 2>&1
   ret_val=$?
   if [ $ret_val -eq 0 ]; then
     APP_IMAGE_ID="$(tail -n 1 "$log_file")"
+    [ -z "$cache_key" ] || ct_app_image_cache_add "$cache_key"
   fi
 
   cat "$log_file" ; rm -r "$log_file"
   return "$ret_val"
 }
 
+# ct_app_image_cache_key DOCKERFILE PARAMS
+# --------------------
+# Prints a hash of everything an app image built by ct_build_image_and_parse_id
+# depends on: IDs of the base images, the Dockerfile, the build params except
+# tags and the files in the build context (the last directory in the params).
+# Fails if a base image is not present locally.
+# Argument: DOCKERFILE - path to the Dockerfile, Dockerfile in the context if empty
+# Argument: PARAMS - build params
+ct_app_image_cache_key() {
+  local dockerfile=$1
+  local words=()
+  local word
+  local context=
+  local skip_next=
+  local key_params=()
+  local image_name
+  local image_id
+  local from=
+  read -ra words <<< "$(echo "$2" | tr -d "'")"
+  for word in "${words[@]}"; do
+    [ -d "$word" ] && context=$word
+  done
+  [ -n "$context" ] || return 1
+  [ -n "$dockerfile" ] || dockerfile=$context/Dockerfile
+  [ -f "$dockerfile" ] || return 1
+  # Tags and the path of the context do not change the built image
+  for word in "${words[@]}"; do
+    if [ -n "$skip_next" ]; then
+      skip_next=
+      continue
+    fi
+    case "$word" in
+      -t|--tag) skip_next=1 ;;
+      --tag=*|"$context") ;;
+      *) key_params+=("$word") ;;
+    esac
+  done
+  # Base images, except scratch and the previous stages
+  for image_name in $(awk 'toupper($1) == "FROM" {
+                             i = 2; while ($i ~ /^--/) i++
+                             if (!($i in stages) && $i != "scratch") print $i
+                             if (toupper($(i + 1)) == "AS") stages[$(i + 2)] = 1
+                           }' "$dockerfile"); do
+    image_id=$(docker inspect -f '{{.Id}}' "$image_name" 2>/dev/null) || return 1
+    from+="from $image_name $image_id"$'\n'
+  done
+  local skip=( \( -name .git -o -samefile "$dockerfile" \) -prune )
+  {
+    echo -n "$from"
+    echo "dockerfile $(sha256sum < "$dockerfile")"
+    echo "params ${key_params[*]}"
+    # Names, types, modes, sizes and symlink targets of the context files,
+    # then their content
+    find "$context" "${skip[@]}" -o -printf '%P %y %m %s %l\n' | LC_ALL=C sort
+    find "$context" "${skip[@]}" -o -type f -print0 | LC_ALL=C sort -z | xargs -0r cat | sha256sum
+  } | sha256sum | cut -d' ' -f1
+}
+
+# ct_app_image_cache_reuse KEY PARAMS
+# --------------------
+# Tags the app image built before with the cache key by the tags from
+# the build params, if the image still exists.
+# Argument: KEY - cache key from ct_app_image_cache_key
+# Argument: PARAMS - build params
+# Sets: $APP_IMAGE_ID - ID of the reused image
+ct_app_image_cache_reuse() {
+  local entry=${CT_APP_IMAGE_CACHE_DIR}/$1
+  local words=()
+  local image_id
+  local i
+  [ -f "$entry" ] || return 1
+  image_id=$(cat "$entry")
+  if ! docker inspect -f '{{.Id}}' "$image_id" &>/dev/null; then
+    rm -f "$entry"
+    return 1
+  fi
+  read -ra words <<< "$(echo "$2" | tr -d "'")"
+  for (( i = 0; i < ${#words[@]}; i++ )); do
+    case "${words[i]}" in
+      -t|--tag) docker tag "$image_id" "${words[i + 1]}" || return 1 ;;
+      --tag=*) docker tag "$image_id" "${words[i]#--tag=}" || return 1 ;;
+    esac
+  done
+  touch "$entry"
+  echo "Reusing app image $image_id, it was built from the same images, Dockerfile and sources"
+  APP_IMAGE_ID=$image_id
+}
+
+# ct_app_image_cache_add KEY
+# --------------------
+# Adds the app image just built with the cache key to the pool of app images
+# and removes the least recently used images over the size of the pool.
+# Argument: KEY - cache key from ct_app_image_cache_key
+# Uses: $CT_APP_IMAGE_CACHE_SIZE - number of app images kept (default: 10)
+ct_app_image_cache_add() {
+  local key=$1
+  local max_size=${CT_APP_IMAGE_CACHE_SIZE:-10}
+  mkdir -p "$CT_APP_IMAGE_CACHE_DIR"
+  docker inspect -f '{{.Id}}' "$CT_APP_IMAGE_CACHE_REPO:${key:0:16}" > "$CT_APP_IMAGE_CACHE_DIR/$key" || return 1
+  (
+    flock 9
+    # From the least recently used image
+    find "$CT_APP_IMAGE_CACHE_DIR" -maxdepth 1 -type f -name '[0-9a-f]*' -printf '%T@ %f\n' \
+      | sort -n | head -n "-$max_size" | cut -d' ' -f2 | while read -r key; do
+        echo "Removing least recently used app image $(cat "$CT_APP_IMAGE_CACHE_DIR/$key")"
+        # The image is kept while other tags or containers use it
+        docker rmi "$CT_APP_IMAGE_CACHE_REPO:${key:0:16}" >/dev/null || continue
+        rm -f "${CT_APP_IMAGE_CACHE_DIR:?}/$key"
+      done
+  ) 9>"$CT_APP_IMAGE_CACHE_DIR/.lock"
+}
+
 # ct_container_running
 # --------------------
 # Return 0 if given container is in running state
@@ -112,30 +261,62 @@ function ct_container_exists() {
 
 # ct_clean_app_images
 # --------------------
-# Cleans up application images referenced by APP_ID_FILE_DIR
+# Cleans up application images referenced by APP_ID_FILE_DIR.
+# All the images are looked up by a single docker call, containers
+# created from them are removed by another one and the images by a third one.
 # Uses: $APP_ID_FILE_DIR - path to directory containing image ID files
 function ct_clean_app_images() {
-  local image
+  local file
+  local images=()
+  local existing
+  local containers
+  local filters=()
   if [[ ! -d "${APP_ID_FILE_DIR:-}" ]]; then
     echo "The \$APP_ID_FILE_DIR=$APP_ID_FILE_DIR is not created. App cleaning is to be skipped."
     return 0
   fi;
   echo "Examining image ID files in \$APP_ID_FILE_DIR=$APP_ID_FILE_DIR"
   for file in "${APP_ID_FILE_DIR:?}"/*; do
-    image="$(cat "$file")"
-    docker inspect "$image" > /dev/null 2>&1 || continue
-    containers="$(docker ps -q -a -f ancestor="$image")"
-    [[ -z "$containers" ]] || docker rm -f "$containers" 2>/dev/null
-    docker rmi -f "$image"
+    [ -f "$file" ] && images+=("$(cat "$file")")
   done
+  if [ ${#images[@]} -gt 0 ]; then
+    # Images that do not exist anymore are not printed
+    mapfile -t existing < <(docker inspect -f '{{.Id}}' "${images[@]}" 2>/dev/null)
+    # App images in the pool of ct_build_image_and_parse_id are kept
+    if [ -n "${CT_APP_IMAGE_CACHE:-}" ] && [ ${#existing[@]} -gt 0 ]; then
+      mapfile -t existing < <(printf '%s\n' "${existing[@]}" \
+        | grep -vxF -f <(cat "$CT_APP_IMAGE_CACHE_DIR"/[0-9a-f]* 2>/dev/null))
+    fi
+    if [ ${#existing[@]} -gt 0 ]; then
+      for file in "${existing[@]}"; do
+        filters+=(-f "ancestor=$file")
+      done
+      mapfile -t containers < <(docker ps -q -a "${filters[@]}")
+      [ ${#containers[@]} -eq 0 ] || docker rm -f "${containers[@]}" 2>/dev/null
+      docker rmi -f "${existing[@]}"
+    fi
+  fi
   rm -fr "$APP_ID_FILE_DIR"
 }
 
 # ct_clean_containers
 # --------------------
-# Cleans up containers referenced by CID_FILE_DIR
+# Cleans up containers referenced by CID_FILE_DIR.
+# The containers are inspected by a single docker call, the running ones
+# are stopped at once and all of them are removed at once as well.
+# Logs are dumped only for containers that exited with an unexpected code.
 # Uses: $CID_FILE_DIR - path to directory containing cid_files
+# Uses: $EXPECTED_EXIT_CODE - expected container exit code
+# Uses: $CT_STOP_TIMEOUT - seconds the containers have to stop before they
+#                          are killed (default: 10)
 function ct_clean_containers() {
+  local cid_file
+  local containers=()
+  local existing=()
+  local running=()
+  local container
+  local is_running
+  local exit_status
   if [[ -z ${CID_FILE_DIR:-} ]]; then
     echo "The \$CID_FILE_DIR is not set. Container cleaning is to be skipped."
     return
@@ -143,25 +324,28 @@ function ct_clean_containers() {
 
   echo "Examining CID files in \$CID_FILE_DIR=$CID_FILE_DIR"
   for cid_file in "$CID_FILE_DIR"/* ; do
-    [ -f "$cid_file" ] || continue
-    local container
-    container=$(cat "$cid_file")
-
-    ct_container_exists "$container" || continue
+    [ -f "$cid_file" ] && [ -s "$cid_file" ] && containers+=("$(cat "$cid_file")")
+  done
 
-    echo "Stopping and removing container $container..."
-    if ct_container_running "$container"; then
-      docker stop "$container"
-    fi
+  if [ ${#containers[@]} -gt 0 ]; then
+    # Containers that do not exist anymore are not printed
+    while read -r container is_running ; do
+      existing+=("$container")
+      [ "$is_running" == "true" ] && running+=("$container")
+    done < <(docker inspect -f '{{.Id}} {{.State.Running}}' "${containers[@]}" 2>/dev/null)
+  fi
 
-    exit_status=$(docker inspect -f '{{.State.ExitCode}}' "$container")
-    if [ "$exit_status" != "$EXPECTED_EXIT_CODE" ]; then
-      echo "Dumping logs for $container"
-      docker logs "$container"
-    fi
-    docker rm -v "$container"
-    rm -f "$cid_file"
-  done
+  if [ ${#existing[@]} -gt 0 ]; then
+    echo "Stopping and removing containers ${existing[*]}..."
+    [ ${#running[@]} -eq 0 ] || docker stop -t "${CT_STOP_TIMEOUT:-10}" "${running[@]}"
+    while read -r container exit_status ; do
+      if [ "$exit_status" != "$EXPECTED_EXIT_CODE" ]; then
+        echo "Dumping logs for $container"
+        docker logs "$container"
+      fi
+    done < <(docker inspect -f '{{.Id}} {{.State.ExitCode}}' "${existing[@]}")
+    docker rm -v "${existing[@]}"
+  fi
 
   rm -rf "$CID_FILE_DIR"
 }
@@ -330,6 +514,76 @@ function ct_get_cip() {
   docker inspect --format='{{.NetworkSettings.IPAddress}}' "$(ct_get_cid "$id")"
 }
 
+# ct_wait_for [label, timeout, command]
+# --------------------
+# Runs the command repeatedly until it succeeds or until the timeout passes.
+# The first attempts are only $CT_WAIT_INTERVAL seconds apart (default 0.1),
+# the interval doubles after every attempt up to $CT_WAIT_MAX_INTERVAL seconds
+# (default 2), so things that get ready quickly are not waited for long.
+# If the command exits with 255, waiting stops right away and fails.
+# Put '!' before the command to wait until the command fails.
+# The time it took is stored in $CT_WAIT_TIME and recorded by record_metric
+# as a 'ready' phase, together with the label and the current test case.
+# Argument: label - what is waited for, used in messages and metrics
+# Argument: timeout - overall deadline in seconds
+# Argument: command - command with its arguments, succeeding once ready
+function ct_wait_for() {
+  local label="$1"
+  local timeout="$2"
+  shift 2
+  local negate=0
+  local interval="${CT_WAIT_INTERVAL:-0.1}"
+  local max_interval="${CT_WAIT_MAX_INTERVAL:-2}"
+  local time_beg
+  local attempt=0
+  local ret=1
+  local status
+  local pause
+  local more
+  if [ "${1:-}" == "!" ]; then
+    negate=1
+    shift
+  fi
+  time_beg=$(date '+%s.%N')
+  while true; do
+    attempt=$(( attempt + 1 ))
+    "$@" && status=0 || status=$?
+    [ "$status" -eq 255 ] && break
+    if { [ "$negate" -eq 0 ] && [ "$status" -eq 0 ]; } || { [ "$negate" -eq 1 ] && [ "$status" -ne 0 ]; }; then
+      ret=0
+      break
+    fi
+    # Sleep for the interval, but not past the deadline
+    read -r CT_WAIT_TIME pause interval more < <(awk -v beg="$time_beg" -v now="$(date '+%s.%N')" \
+      -v timeout="$timeout" -v interval="$interval" -v max="$max_interval" 'BEGIN {
+        left = timeout - (now - beg)
+        next_interval = (interval * 2 > max) ? max : interval * 2
+        printf "%.3f %.3f %s %d\n", now - beg, (left < interval) ? left : interval, next_interval, (left > 0)
+      }')
+    [ "$more" -eq 1 ] || break
+    sleep "$pause"
+  done
+  CT_WAIT_TIME=$(awk -v beg="$time_beg" -v now="$(date '+%s.%N')" 'BEGIN { printf "%.3f", now - beg }')
+  if [ "$ret" -eq 0 ]; then
+    echo "  ${label} ready after ${CT_WAIT_TIME}s (${attempt} attempts)"
+  else
+    echo "  ${label} not ready after ${CT_WAIT_TIME}s (${attempt} attempts), giving up"
+  fi
+  record_metric ready "${VERSION:-}" "$time_beg" "$ret" what="$label" test_case="${test_case:-}" attempts="$attempt"
+  return "$ret"
+}
+
+# ct_port_open [host, port]
+# --------------------
+# Returns 0 if a TCP connection to the port can be opened, within a second.
+# Argument: host - host name or IP address
+# Argument: port - TCP port
+function ct_port_open() {
+  local host="$1"
+  local port="$2"
+  timeout 1 bash -c 'exec 3<>"/dev/tcp/$1/$2"' ct_port_open "$host" "$port" 2>/dev/null
+}
+
 # ct_wait_for_cid [cid_file]
 # --------------------
 # Holds the execution until the cid_file is created. Usually run after container
@@ -337,17 +591,7 @@ function ct_get_cip() {
 # Argument: cid_file - name of the cid_file that should be created
 function ct_wait_for_cid() {
   local cid_file=$1
-  local max_attempts=10
-  local sleep_time=1
-  local attempt=1
-  local result=1
-  while [ $attempt -le $max_attempts ]; do
-    [ -f "$cid_file" ] && [ -s "$cid_file" ] && return 0
-    echo "Waiting for container start... $attempt"
-    attempt=$(( attempt + 1 ))
-    sleep $sleep_time
-  done
-  return 1
+  ct_wait_for "container start" 10 test -s "$cid_file"
 }
 
 # ct_assert_container_creation_fails [container_args]
@@ -358,8 +602,6 @@ function ct_wait_for_cid() {
 # Uses: $CID_FILE_DIR - path to directory containing cid_files
 function ct_assert_container_creation_fails() {
   local ret=0
-  local max_attempts=10
-  local attempt=1
   local cid_file=assert
   local old_container_args="${CONTAINER_ARGS-}"
   # we really work with CONTAINER_ARGS as with a string
@@ -369,15 +611,10 @@ function ct_assert_container_creation_fails() {
     local cid
     cid=$(ct_get_cid "$cid_file")
 
-    while [ "$(docker inspect -f '{{.State.Running}}' "$cid")" == "true" ] ; do
-      sleep 2
-      attempt=$(( attempt + 1 ))
-      if [ "$attempt" -gt "$max_attempts" ]; then
-        docker stop "$cid"
-        ret=1
-        break
-      fi
-    done
+    if ! ct_wait_for "container exit" 20 ! ct_container_running "$cid" ; then
+      docker stop "$cid"
+      ret=1
+    fi
     exit_status=$(docker inspect -f '{{.State.ExitCode}}' "$cid")
     if [ "$exit_status" == "0" ]; then
       ret=1
@@ -653,51 +890,83 @@ function ct_obtain_input() {
   echo "${output}"
 }
 
+# ct_check_response
+# ----------------
+# Perform a single GET request to the application container, checks output
+# with a reg-exp and HTTP response code.
+# Returns 0 if both match, 1 otherwise. If an unexpected response comes after
+# the strict_after time, 255 is returned, so ct_wait_for stops waiting.
+# Argument: url - request URL path
+# Argument: expected_code - expected HTTP response code
+# Argument: body_regexp - PCRE regular expression that must match the response body
+# Argument: strict_after - Optional time in seconds since unix era
+ct_check_response() {
+  local url="$1"
+  local expected_code="$2"
+  local body_regexp="$3"
+  local strict_after="${4:-}"
+  local ret=1
+  local response_code
+  local response_file
+  response_file=$(mktemp /tmp/ct_test_response_XXXXXX)
+  if curl --connect-timeout 10 -s -w '%{http_code}' "${url}" >"${response_file}"; then
+    response_code=$(tail -c 3 "${response_file}")
+    if [ "${response_code}" -eq "${expected_code}" ] && grep -qP -e "${body_regexp}" "${response_file}"; then
+      ret=0
+    elif [ -n "${strict_after}" ] && [ "$(date '+%s')" -ge "${strict_after}" ]; then
+      ret=255
+    fi
+  fi
+  rm -f "${response_file}"
+  return "${ret}"
+}
+
 # ct_test_response
 # ----------------
 # Perform GET request to the application container, checks output with
-# a reg-exp and HTTP response code.
+# a reg-exp and HTTP response code. The requests are repeated by ct_wait_for,
+# after the TCP port of the URL is open (unless $CT_WAIT_FOR_PORT is 0).
+# The port is waited for at most 3 seconds per attempt, as long as refused
+# connections used to be retried, and the requests get the rest of the
+# overall deadline.
 # Argument: url - request URL path
 # Argument: expected_code - expected HTTP response code
 # Argument: body_regexp - PCRE regular expression that must match the response body
-# Argument: max_attempts - Optional number of attempts (default: 20), three seconds sleep between
-# Argument: ignore_error_attempts - Optional number of attempts when we ignore error output (default: 10)
+# Argument: max_attempts - Optional number of attempts (default: 20), the overall
+#                          deadline is 13 seconds per attempt, as much as an attempt
+#                          used to take at most (10s connect timeout and 3s sleep)
+# Argument: ignore_error_attempts - Optional number of attempts when we ignore error output (default: 10),
+#                                   i.e. unexpected responses are ignored for three seconds
+#                                   per attempt after the port is open
+# Uses: $CT_TEST_RESPONSE_TIMEOUT - overall deadline in seconds, overrides the one
+#                                   derived from max_attempts
 ct_test_response() {
   local url="$1"
   local expected_code="$2"
   local body_regexp="$3"
   local max_attempts=${4:-20}
   local ignore_error_attempts=${5:-10}
+  local timeout=${CT_TEST_RESPONSE_TIMEOUT:-$(( max_attempts * 13 ))}
+  local port_timeout=$(( max_attempts * 3 ))
+  local deadline
+  local strict_after
+  local host
+  local port
 
   echo "  Testing the HTTP(S) response for <${url}>"
-  local sleep_time=3
-  local attempt=1
-  local result=1
-  local status
-  local response_code
-  local response_file
-  response_file=$(mktemp /tmp/ct_test_response_XXXXXX)
-  while [ "${attempt}" -le "${max_attempts}" ]; do
-    echo "Trying to connect ... ${attempt}"
-    curl --connect-timeout 10 -s -w '%{http_code}' "${url}" >"${response_file}" && status=0 || status=1
-    if [ "${status}" -eq 0 ]; then
-      response_code=$(tail -c 3 "${response_file}")
-      if [ "${response_code}" -eq "${expected_code}" ]; then
-        result=0
-      fi
-      grep -qP -e "${body_regexp}" "${response_file}" || result=1;
-      # Some services return 40x code until they are ready, so let's give them
-      # some chance and not end with failure right away
-      # Do not wait if we already have expected outcome though
-      if [ "${result}" -eq 0 ] || [ "${attempt}" -gt "${ignore_error_attempts}" ] || [ "${attempt}" -eq "${max_attempts}" ] ; then
-        break
-      fi
-    fi
-    attempt=$(( attempt + 1 ))
-    sleep "${sleep_time}"
-  done
-  rm -f "${response_file}"
-  return "${result}"
+  deadline=$(( $(date '+%s') + timeout ))
+  [ "${port_timeout}" -lt "${timeout}" ] || port_timeout=${timeout}
+  if [ "${CT_WAIT_FOR_PORT:-1}" != "0" ] && [[ "${url}" =~ ^(https?)://(\[([^]]+)\]|[^/:]+)(:([0-9]+))? ]]; then
+    host="${BASH_REMATCH[3]:-${BASH_REMATCH[2]}}"
+    port="${BASH_REMATCH[5]}"
+    [ -z "${port}" ] && { [ "${BASH_REMATCH[1]}" == "https" ] && port=443 || port=80; }
+    ct_wait_for "port ${host}:${port}" "${port_timeout}" ct_port_open "${host}" "${port}" || return 1
+  fi
+  # Some services return 40x code until they are ready, so let's give them
+  # some chance and not end with failure right away
+  strict_after=$(( $(date '+%s') + ignore_error_attempts * 3 ))
+  ct_wait_for "response of <${url}>" "$(( deadline - $(date '+%s') ))" \
+    ct_check_response "${url}" "${expected_code}" "${body_regexp}" "${strict_after}"
 }
 
 # ct_registry_from_os OS
@@ -1036,18 +1305,83 @@ EOF
   )
 }
 
-# ct_check_image_availability PUBLIC_IMAGE_NAME
+# ct_registry_probe_cache_init
+# ----------------------------
+# Creates the file for answers of ct_registry_probe, unless it is set already.
+# It has to be called before ct_registry_probe runs in a subshell.
+# Sets: $CT_REGISTRY_PROBE_CACHE - path to a temporary file
+ct_registry_probe_cache_init() {
+  if [ -z "${CT_REGISTRY_PROBE_CACHE:-}" ]; then
+    CT_REGISTRY_PROBE_CACHE=$(mktemp)
+    CT_REGISTRY_PROBE_CACHE_CREATED=1
+    export CT_REGISTRY_PROBE_CACHE
+  fi
+}
+
+# ct_registry_probe IMAGE...
+# ----------------------------
+# Asks the registries for the manifests of the images, all at once, without
+# pulling them. Prints "<image> <status> <digest>" separated by tabs for every
+# image, the status is one of available, missing, unauthorized or error.
+# Answers are cached for the whole test run.
+# Argument: IMAGE - string containing the name of the image
+# Uses: $CT_REGISTRY_PROBE_CACHE - file with the cached answers, a temporary
+#                                  file removed by ct_cleanup by default
+# Uses: $CT_INSECURE_REGISTRIES - registries accessed over plain HTTP,
+#                                 registries on localhost always are
+ct_registry_probe() {
+  ct_registry_probe_cache_init
+  python3 "$(dirname "$(readlink -f "${BASH_SOURCE[0]}")")/registry_probe.py" \
+    --cache "$CT_REGISTRY_PROBE_CACHE" "$@"
+}
+
+# ct_get_image_digest IMAGE
 # ----------------------------
-# Pull an image from the public repositories to see if the image is already available.
-# Argument: PUBLIC_IMAGE_NAME - string containing the public name of the image to pull
+# Prints the digest of the image manifest in the registry, without pulling it.
+# Argument: IMAGE - string containing the name of the image
+ct_get_image_digest() {
+  local status
+  local digest
+  ct_registry_probe_cache_init
+  IFS=$'\t' read -r _ status digest < <(ct_registry_probe "$1")
+  [ "$status" == "available" ] && echo "$digest"
+}
+
+# ct_check_image_availability PUBLIC_IMAGE_NAME...
+# ----------------------------
+# Check that images are available in the public repositories. The registries
+# are only asked for the manifests of the images, concurrently. Images the
+# registry refuses to show with the credentials found by registry_probe.py
+# are pulled once, as docker may be logged in some other way.
+# Argument: PUBLIC_IMAGE_NAME - string containing the public name of the image
+# Uses: $CT_IMAGE_AVAILABILITY_PULL - if set, the images are pulled instead
 ct_check_image_availability() {
-  local public_image_name=$1;
+  local public_image_name
+  local status
+  local ret=0
 
-  # Try pulling the image to see if it is accessible
-  if ! ct_pull_image "$public_image_name" &>/dev/null; then
-    echo "$public_image_name could not be downloaded via 'docker'"
-    return 1
+  if [ -n "${CT_IMAGE_AVAILABILITY_PULL:-}" ]; then
+    for public_image_name in "$@"; do
+      # Try pulling the image to see if it is accessible
+      if ! ct_pull_image "$public_image_name" &>/dev/null; then
+        echo "$public_image_name could not be downloaded via 'docker'"
+        ret=1
+      fi
+    done
+    return "$ret"
   fi
+
+  ct_registry_probe_cache_init
+  while IFS=$'\t' read -r public_image_name status _; do
+    if [ "$status" == "unauthorized" ] && ct_pull_image "$public_image_name" false 0 &>/dev/null </dev/null; then
+      continue
+    fi
+    if [ "$status" != "available" ]; then
+      echo "$public_image_name is not available in the registry ($status)"
+      ret=1
+    fi
+  done < <(ct_registry_probe "$@")
+  return "$ret"
 }
 
 
@@ -1066,15 +1400,21 @@ ct_check_latest_imagestreams() {
       return 0
     fi
 
-    # Check only lines which starts with VERSIONS
-    latest_version=$(grep '^VERSIONS' Makefile | rev | cut -d ' ' -f 1 | rev )
-    # Fall back to previous version if the latest is excluded for this OS
-    [ -f "$latest_version/.exclude-$OS" ] && latest_version=$(grep '^VERSIONS' Makefile | rev | cut -d ' ' -f 2 | rev )
-    # Only test the imagestream once, when the version matches
-    # ignore the SC warning, $VERSION is always available
-
     test_lib_dir=$(dirname "$(readlink -f "$0")")
+    # The last version from VERSIONS in Makefile, which is not excluded for this OS.
+    # repo_model.py is next to this file, unlike the imagestream scripts linked
+    # into the test directory.
+    latest_version=$(eval "$(python3 "$(dirname "$(readlink -f "${BASH_SOURCE[0]}")")/repo_model.py" \
+                               --os "$OS" --format shell)" \
+                     && echo "$REPO_LATEST_VERSION")
+    if [ -z "$latest_version" ]; then
+      echo "ERROR: The latest version for $OS cannot be determined from the Makefile."
+      return 1
+    fi
+
     python3 "${test_lib_dir}/show_all_imagestreams.py"
+    # Only test the imagestream once, when the version matches
+    # ignore the SC warning, $VERSION is always available
     # shellcheck disable=SC2153
     if [ "$latest_version" == "$VERSION" ]; then
       python3 "${test_lib_dir}/check_imagestreams.py" "$latest_version"
@@ -1101,26 +1441,134 @@ ct_show_resources()
   echo "$LINE"
   echo "Image ${IMAGE_NAME} information:"
   echo "$LINE"
-  echo "Uncompressed size of the image: $(ct_get_image_size_uncompresseed "${IMAGE_NAME}")"
-  echo "Compressed size of the image: $(ct_get_image_size_compresseed "${IMAGE_NAME}")"
+  local time_beg
+  local size_uncompressed
+  local size_compressed
+  time_beg=$(date '+%s.%N')
+  size_uncompressed=$(ct_get_image_size_uncompresseed "${IMAGE_NAME}")
+  size_compressed=$(ct_get_image_size_compresseed "${IMAGE_NAME}")
+  echo "Uncompressed size of the image: ${size_uncompressed}"
+  echo "Compressed size of the image: ${size_compressed}"
   echo
+  record_metric image-size "${VERSION:-}" "$time_beg" 0 image="${IMAGE_NAME}" \
+    uncompressed="${size_uncompressed}" compressed="${size_compressed}"
+}
+
+# ct_git_mirror_evict
+# -----------------------------
+# Removes the least recently used git mirrors until all of them take at most
+# $CT_GIT_MIRROR_MAX_SIZE megabytes (default: 1024). Mirrors locked by tests
+# cloning from them are skipped. The lock files are kept, so that tests waiting
+# for a lock keep using the same one.
+# Argument: mirror_dir - directory of the mirrors
+# Argument: keep (optional) - mirror that is never removed
+ct_git_mirror_evict()
+{
+  local mirror_dir=$1
+  local keep=${2:-}
+  local max_size=${CT_GIT_MIRROR_MAX_SIZE:-1024}
+  local total=0
+  local size
+  local mirror
+  # From the most recently used mirror
+  while read -r mirror ; do
+    size=$(du -sm "$mirror" | cut -f1)
+    total=$(( total + size ))
+    if [ "$total" -gt "$max_size" ] && [ "$mirror" != "$keep" ] &&
+       ( flock -n 9 && rm -rf "$mirror" ) 9>"${mirror%.git}.lock"; then
+      echo "Removed least recently used git mirror $mirror"
+      total=$(( total - size ))
+    fi
+  done < <(find "$mirror_dir" -mindepth 1 -maxdepth 1 -name '*.git' -printf '%T@ %p\n' | sort -rn | cut -d' ' -f2-)
+}
+
+# ct_git_mirror_update
+# -----------------------------
+# Updates a bare mirror of a repository by a shallow fetch of a single branch
+# and prints the name of the branch. With $CT_GIT_OFFLINE set, the mirror is
+# only checked to contain the branch.
+# Argument: mirror - directory of the mirror
+# Argument: url - git URI of the repository
+# Argument: branch (optional) - branch to fetch, the default branch of the repository by default
+ct_git_mirror_update()
+{
+  local mirror=$1
+  local url=$2
+  local branch=${3:-}
+  if [ -n "${CT_GIT_OFFLINE:-}" ]; then
+    [ -n "$branch" ] || branch=$(git -C "$mirror" symbolic-ref --short HEAD 2>/dev/null) || return 1
+    git -C "$mirror" rev-parse -q --verify "refs/heads/$branch" >/dev/null || return 1
+  else
+    if [ ! -d "$mirror" ]; then
+      { git init -q --bare "$mirror" && git -C "$mirror" remote add origin "$url" ; } || return 1
+    fi
+    if [ -z "$branch" ]; then
+      branch=$(git -C "$mirror" ls-remote --symref origin HEAD | sed -n 's|^ref: refs/heads/\(.*\)\tHEAD$|\1|p')
+      [ -n "$branch" ] || return 1
+      git -C "$mirror" symbolic-ref HEAD "refs/heads/$branch"
+    fi
+    git -C "$mirror" fetch -q --depth 1 origin "+refs/heads/$branch:refs/heads/$branch" || return 1
+  fi
+  touch "$mirror"
+  echo "$branch"
 }
 
 # ct_clone_git_repository
 # -----------------------------
+# With $CT_GIT_MIRROR_DIR set, the repository is cloned from a local mirror,
+# which is only updated by a shallow fetch of the branch, so the same sample
+# applications are not downloaded again for every tested version. The clone
+# then contains only the last commit of the branch (like --depth 1), unlike
+# the direct clone used without the mirrors, so tests using the history, tags
+# or other branches of the repository must not enable the mirrors.
+# Uses: $CT_GIT_MIRROR_DIR - directory of the mirrors, e.g.
+#                            ~/.cache/container-common-scripts/git-mirrors,
+#                            the mirrors are not used by default
+# Uses: $CT_GIT_MIRROR_MAX_SIZE - size limit of the mirrors in megabytes (default: 1024)
+# Uses: $CT_GIT_OFFLINE - if set, the repository is cloned only from the mirror
 # Argument: app_url - git URI pointing to a repository, supports "@" to indicate a different branch
 # Argument: app_dir (optional) - name of the directory to clone the repository into
 ct_clone_git_repository()
 {
   local app_url=$1; shift
   local app_dir=$1
+  local mirror_dir=${CT_GIT_MIRROR_DIR:-}
+  local mirror
+  local url
+  local branch
 
   # If app_url contains @, the string after @ is considered
   # as a name of a branch to clone instead of the main/master branch
   IFS='@' read -ra git_url_parts <<< "${app_url}"
+  url=${git_url_parts[0]}
+  branch=${git_url_parts[1]:-}
+  [ -n "${app_dir}" ] || app_dir=$(basename "${url}" .git)
+
+  if [ -n "${mirror_dir}" ]; then
+    mkdir -p "${mirror_dir}"
+    mirror="${mirror_dir}/$(echo -n "${url}" | sha256sum | cut -c1-16).git"
+    # Tests running at the same time use the mirror one by one
+    if (
+      flock 9
+      branch=$(ct_git_mirror_update "${mirror}" "${url}" "${branch}") &&
+        git clone -q --single-branch --branch "${branch}" "file://${mirror}" "${app_dir}" &&
+        git -C "${app_dir}" remote set-url origin "${url}"
+    ) 9>"${mirror%.git}.lock"; then
+      ct_git_mirror_evict "${mirror_dir}" "${mirror}"
+      return 0
+    fi
+    if [ -z "${CT_GIT_OFFLINE:-}" ]; then
+      echo "WARNING: Git repository ${app_url} cannot be cloned from the mirror ${mirror}, cloning it directly."
+    fi
+  fi
+
+  if [ -n "${CT_GIT_OFFLINE:-}" ]; then
+    echo "ERROR: Git repository ${app_url} is not mirrored in '${mirror_dir}', it cannot be cloned offline."
+    return 1
+  fi
 
-  if [ -n "${git_url_parts[1]}" ]; then
-    git_clone_cmd="git clone --branch ${git_url_parts[1]} ${git_url_parts[0]} ${app_dir}"
+  if [ -n "${branch}" ]; then
+    git_clone_cmd="git clone --branch ${branch} ${url} ${app_dir}"
   else
     git_clone_cmd="git clone ${app_url} ${app_dir}"
   fi
@@ -1231,8 +1679,12 @@ ct_test_app_dockerfile() {
   [[ $ret -eq 0 ]] || docker logs "$(ct_get_cid "${cname}")"
 
   # cleanup
-  docker kill "$(ct_get_cid "${cname}")"
-  sleep 2
+  local cid
+  cid="$(ct_get_cid "${cname}")"
+  docker kill "$cid"
+  # the container is started with --rm, its image can be removed once it is gone
+  # (an image in the pool of ct_build_image_and_parse_id only loses the name)
+  ct_wait_for "container removal" 10 ! ct_container_exists "$cid"
   docker rmi "${app_image_name}"
   popd >/dev/null || return 1
   rm -rf "${tmpdir}"
@@ -1271,24 +1723,62 @@ ct_update_test_result() {
   printf -v TEST_SUMMARY "%s %s for '%s' %s (%s)\n" "${TEST_SUMMARY:-}" "${test_msg}" "${app_name}" "$test_case" "$time_diff"
 }
 
+# ct_record_testcase_result
+# -----------------------------
+# Evaluates $TESTCASE_RESULT of a finished test case, updates the
+# $TESTSUITE_RESULT and adds the result to the $TEST_SUMMARY variable
+# Argument: app_name - application name to log
+# Argument: test_case - name of the finished test case
+# Argument: time_diff - duration of the test case
+# Uses: $TESTCASE_RESULT - result of the finished test case
+# Uses: $UNSTABLE_TESTS - set of tests, whose result can be ignored
+# Uses: $IGNORE_UNSTABLE_TESTS - flag to ignore unstable tests
+ct_record_testcase_result() {
+  local app_name="$1"
+  local test_case="$2"
+  local time_diff="$3"
+  local test_msg
+  local is_unstable
+
+  # shellcheck disable=SC2076
+  if [[ " ${UNSTABLE_TESTS[*]} " =~ " ${app_name} " ]] || \
+     [[ " ${UNSTABLE_TESTS[*]} " =~ " ${test_case} " ]]; then
+    is_unstable=1
+  else
+    is_unstable=0
+  fi
+  if [ "$TESTCASE_RESULT" -eq 0 ]; then
+    test_msg="[PASSED]"
+  else
+    if [ -n "${IGNORE_UNSTABLE_TESTS:-""}" ] && [ $is_unstable -eq 1 ]; then
+      test_msg="[FAILED][UNSTABLE-IGNORED]"
+    else
+      test_msg="[FAILED]"
+      TESTSUITE_RESULT=1
+    fi
+  fi
+  ct_update_test_result "${test_msg}" "${app_name}" "$test_case" "$time_diff"
+}
+
 # ct_run_tests_from_testset
 # -----------------------------
 # Runs all tests in $TEST_SET, prints result to
 # the $TEST_SUMMARY variable
+# If $PARALLEL_TESTS is set to a number greater than 1, the test cases
+# are run in parallel, see ct_run_tests_from_testset_parallel.
 # Argument: app_name - application name to log
 # Uses: $TEST_SET - set of test cases to run
 # Uses: $TEST_SUMMARY - variable for storing test results
 # Uses: $IMAGE_NAME - name of the image being tested
 # Uses: $UNSTABLE_TESTS - set of tests, whose result can be ignored
 # Uses: $IGNORE_UNSTABLE_TESTS - flag to ignore unstable tests
+# Uses: $PARALLEL_TESTS - maximum number of test cases run at the same time
 ct_run_tests_from_testset() {
   local app_name="${1:-appnamenotset}"
   local time_beg_pretty
   local time_beg
   local time_end
   local time_diff
-  local test_msg
-  local is_unstable
 
   # Let's store in the log what change do we test
   echo
@@ -1297,15 +1787,17 @@ ct_run_tests_from_testset() {
 
   echo "Running tests for image ${IMAGE_NAME}"
 
-  for test_case in $TEST_SET; do
-    TESTCASE_RESULT=0
-    # shellcheck disable=SC2076
-    if [[ " ${UNSTABLE_TESTS[*]} " =~ " ${app_name} " ]] || \
-       [[ " ${UNSTABLE_TESTS[*]} " =~ " ${test_case} " ]]; then
-      is_unstable=1
+  if [ "${PARALLEL_TESTS:-1}" -gt 1 ]; then
+    if [ "${CT_OCP4_TEST:-false}" == "true" ]; then
+      echo "Test cases for OpenShift 4 switch projects, running them sequentially."
     else
-      is_unstable=0
+      ct_run_tests_from_testset_parallel "$app_name"
+      return
     fi
+  fi
+
+  for test_case in $TEST_SET; do
+    TESTCASE_RESULT=0
     time_beg_pretty=$(ct_timestamp_pretty)
     time_beg=$(ct_timestamp_s)
     echo "-----------------------------------------------"
@@ -1314,26 +1806,74 @@ ct_run_tests_from_testset() {
     $test_case
     ct_check_testcase_result $?
     time_end=$(ct_timestamp_s)
-    if [ $TESTCASE_RESULT -eq 0 ]; then
-      test_msg="[PASSED]"
-    else
-      if [ -n "${IGNORE_UNSTABLE_TESTS:-""}" ] && [ $is_unstable -eq 1 ]; then
-        test_msg="[FAILED][UNSTABLE-IGNORED]"
-      else
-        test_msg="[FAILED]"
-        TESTSUITE_RESULT=1
-      fi
-    fi
     # As soon as test is finished
     # switch the project from sclorg-test-<NUMBER> to default.
     if [ "${CT_OCP4_TEST:-false}" == "true" ]; then
       oc project default
     fi
     time_diff=$(ct_timestamp_diff "$time_beg" "$time_end")
-    ct_update_test_result "${test_msg}" "${app_name}" "$test_case" "$time_diff"
+    ct_record_testcase_result "${app_name}" "$test_case" "$time_diff"
   done
 }
 
+# ct_run_tests_from_testset_parallel
+# -----------------------------
+# Runs all tests in $TEST_SET in parallel, at most $PARALLEL_TESTS
+# at the same time. Use it only for test sets whose test cases are
+# independent, i.e. they use their own containers (cid files) and
+# do not rely on variables set by other test cases.
+# Output of every test case is buffered and printed at once when
+# the test case finishes. Results are added to the $TEST_SUMMARY
+# variable in the order of $TEST_SET.
+# Argument: app_name - application name to log
+# Uses: $TEST_SET - set of test cases to run
+# Uses: $PARALLEL_TESTS - maximum number of test cases run at the same time
+ct_run_tests_from_testset_parallel() {
+  local app_name="${1:-appnamenotset}"
+  local out_dir
+  local pids=()
+  local i=0
+  local result
+  local time_diff
+
+  out_dir=$(mktemp -d)
+  echo "Running test cases in parallel, at most ${PARALLEL_TESTS} at a time."
+  for test_case in $TEST_SET; do
+    while [ "$(jobs -rp | wc -l)" -ge "${PARALLEL_TESTS}" ]; do
+      wait -n
+    done
+    (
+      TESTCASE_RESULT=0
+      time_beg=$(ct_timestamp_s)
+      {
+        echo "-----------------------------------------------"
+        echo "Running test $test_case (starting at $(ct_timestamp_pretty)) ... "
+        echo "-----------------------------------------------"
+        $test_case
+        ct_check_testcase_result $?
+      } > "${out_dir}/${i}.log" 2>&1
+      echo "$TESTCASE_RESULT $(ct_timestamp_diff "$time_beg" "$(ct_timestamp_s)")" > "${out_dir}/${i}.result"
+      flock "${out_dir}/.lock" cat "${out_dir}/${i}.log"
+    ) &
+    pids+=($!)
+    ((i++)) || :
+  done
+  [ ${#pids[@]} -gt 0 ] && wait "${pids[@]}"
+
+  i=0
+  for test_case in $TEST_SET; do
+    # A test case that exited its subshell prematurely has failed
+    if [ ! -f "${out_dir}/${i}.result" ] || ! read -r result time_diff < "${out_dir}/${i}.result"; then
+      result=1
+      time_diff="unknown"
+    fi
+    TESTCASE_RESULT=$result
+    ct_record_testcase_result "${app_name}" "$test_case" "$time_diff"
+    ((i++)) || :
+  done
+  rm -rf "$out_dir"
+}
+
 # ct_timestamp_s
 # --------------
 # Returns timestamp in seconds since unix era -- a large integer
@@ -1423,14 +1963,43 @@ ct_get_image_size_uncompresseed() {
 # ct_get_image_size_compresseed
 # -------------------------------
 # Shows compressed image size in MB
-# This is a slight hack, that counts compressed size based on the compressed
-# content. It might not be entirely same as what docker pull shows, but should
-# be close enough.
+# If the image was pulled from a registry and skopeo is available, the size is
+# the sum of the compressed layer sizes from the image manifest.
+# Otherwise this is a slight hack, that counts compressed size based on the
+# compressed content (using pigz if available). It might not be entirely same
+# as what docker pull shows, but should be close enough.
+# The size is cached per image ID in CT_IMAGE_SIZE_CACHE_DIR directory (set
+# by ct_init), so repeated calls for the same image are cheap.
 # Argument: image_name - image locally available
 ct_get_image_size_compresseed() {
   local image_name=$1
-  local size_bytes
-  size_bytes=$(docker save "${image_name}" | gzip - | wc --bytes)
+  local cache_dir="${CT_IMAGE_SIZE_CACHE_DIR:-}"
+  local image_id
+  local repo_digest
+  local size_bytes=""
+  local compress=gzip
+
+  image_id=$(docker inspect -f '{{.Id}}' "${image_name}") || return 1
+  image_id=${image_id#sha256:}
+  if [ -n "${cache_dir}" ] && [ -s "${cache_dir}/${image_id}" ]; then
+    size_bytes=$(cat "${cache_dir}/${image_id}")
+    echo "$(( size_bytes / 1024 / 1024 ))MB"
+    return 0
+  fi
+
+  repo_digest=$(docker inspect -f '{{if .RepoDigests}}{{index .RepoDigests 0}}{{end}}' "${image_name}" 2>/dev/null)
+  if [ -n "${repo_digest}" ] && command -v skopeo >/dev/null 2>&1; then
+    size_bytes=$(skopeo inspect --format '{{range .LayersData}}{{.Size}} {{end}}' "docker://${repo_digest}" 2>/dev/null \
+      | awk '{ for (i = 1; i <= NF; i++) sum += $i } END { if (sum > 0) print sum }')
+  fi
+  if [ -z "${size_bytes}" ]; then
+    command -v pigz >/dev/null 2>&1 && compress=pigz
+    size_bytes=$(docker save "${image_name}" | "${compress}" - | wc --bytes)
+  fi
+
+  if [ -n "${cache_dir}" ]; then
+    mkdir -p "${cache_dir}" && echo "${size_bytes}" > "${cache_dir}/${image_id}"
+  fi
   echo "$(( size_bytes / 1024 / 1024 ))MB"
 }
 
@@ -5,10 +5,19 @@
 # TEST_MODE - If set, run regular test suite
 # TEST_OPENSHIFT_MODE - If set, run OpenShift tests (if present)
 # VERSIONS - Must be set to a list with possible versions (subdirectories)
+# METRICS_FILE - If set, durations and exit codes of the test scripts
+#                are appended to it as JSON lines
+# TEST_JOBS - If set to a number greater than 1, the versions are tested
+#             concurrently, at most TEST_JOBS at a time
+# TEST_LOG_DIR - Directory for the test logs of the versions in the concurrent
+#                mode, a new temporary directory is used by default
+# MAX_TEST_ATTEMPTS - How many times a test suite failing for a transient reason
+#                     (see failure-patterns) is run (default: 2)
 
 [ -n "${DEBUG:-}" ] && set -x
 
 FAILED_VERSIONS=""
+MAX_TEST_ATTEMPTS=${MAX_TEST_ATTEMPTS:-2}
 
 # shellcheck shell=bash
 # shellcheck source=/dev/null
@@ -31,33 +40,61 @@ failed_version() {
 # run_test_and_analyze_failed_logs
 # ------------------------------------------
 # Function calls specific test suite and in case of failure
-# it sends the failed logs to logdetective and prints report
-# generated by logdetective AI
+# it tells whether the failure looks transient or deterministic
+# (see classify_output). Transient failures are retried, the final
+# failure is sent to logdetective which prints the report generated by AI
 # Argument: test_run - what kind of test that will be executed. Like 'test/run'
 run_test_and_analyze_failed_logs() {
   local test_run="$1"
-  set -o pipefail
-  tmp_file=$(mktemp "/tmp/${OS}-${dir}.XXXXXX")
-  VERSION=$dir $test_run 2>&1 | tee "$tmp_file"
-  ret_code=$?
-  set +o pipefail
-  if [[ "$ret_code" != "0" ]]; then
-    if [[ "${OS}" == "rhel8" ]] || [[ "${OS}" == "rhel9" ]] || [[ "${OS}" == "rhel10" ]]; then
-      analyze_logs_by_logdetective "$tmp_file"
+  local attempt=1
+  local delay=5
+  local sleep_time
+  local time_beg
+  local failure
+  local failure_reason
+  while true; do
+    set -o pipefail
+    tmp_file=$(mktemp "/tmp/${OS}-${dir}.XXXXXX")
+    time_beg=$(metrics_timestamp)
+    VERSION=$dir $test_run 2>&1 | classify_output "$tmp_file.class" | tee "$tmp_file"
+    ret_code=$?
+    set +o pipefail
+    { read -r failure; read -r failure_reason; } < "$tmp_file.class"
+    rm -f "$tmp_file.class"
+    if [[ "$ret_code" == "0" ]]; then
+      record_metric test "$dir" "$time_beg" "$ret_code" test="$test_run" attempt="$attempt"
+      break
     fi
-  fi
+    record_metric test "$dir" "$time_beg" "$ret_code" test="$test_run" attempt="$attempt" failure="$failure"
+    echo "-> Test failure of version $dir looks ${failure}${failure_reason:+, because of: $failure_reason}"
+    # Only failures like registry or repository errors are worth retrying
+    if [[ "$failure" != "transient" ]] || [ "$attempt" -ge "$MAX_TEST_ATTEMPTS" ]; then
+      if [[ "${OS}" == "rhel8" ]] || [[ "${OS}" == "rhel9" ]] || [[ "${OS}" == "rhel10" ]]; then
+        analyze_logs_by_logdetective "$tmp_file"
+      fi
+      break
+    fi
+    rm -f "$tmp_file"
+    ((attempt++))
+    sleep_time=$(( delay + RANDOM % (delay / 2 + 1) ))
+    time_beg=$(metrics_timestamp)
+    sleep "$sleep_time"
+    record_metric retry-sleep "$dir" "$time_beg" 0 test="$test_run" attempt="$attempt"
+    delay=$(( delay * 2 > 60 ? 60 : delay * 2 ))
+    echo "Retrying $test_run for version $dir after $sleep_time seconds, attempt $attempt of $MAX_TEST_ATTEMPTS."
+  done
   failed_version "$ret_code" "$dir"
   rm -f "$tmp_file"
 }
-# This adds backwards compatibility if only single version needs to be testing
-# In CI we would like to test single version but VERSIONS= means, that nothing is tested
-# make test TARGET=<OS> VERSIONS=<something> ... checks single version for CLI
-# make test TARGET=<OS> SINGLE_VERSION=<something> ... checks single version from Testing Farm
-VERSIONS=${SINGLE_VERSION:-$VERSIONS}
-echo "Tested versions are: $VERSIONS"
 
-for dir in ${VERSIONS}; do
-  [ ! -e "${dir}/.image-id" ] && echo "-> Image for version $dir not built, skipping tests." && continue
+# test_version
+# -----------------------------
+# Runs all enabled test suites of a version in its subdirectory
+# and adds the version to FAILED_VERSIONS variable if any of them fails.
+# Argument: dir - version to test
+test_version() {
+  local dir="$1"
+  [ ! -e "${dir}/.image-id" ] && echo "-> Image for version $dir not built, skipping tests." && return 0
   pushd "${dir}" > /dev/null || exit 1
   IMAGE_ID=$(cat .image-id)
   export IMAGE_ID
@@ -114,11 +151,77 @@ for dir in ${VERSIONS}; do
   fi
 
   popd > /dev/null || exit 1
-done
+}
+
+# test_version_logged
+# -----------------------------
+# Tests a single version in a subshell. The output is stored in a log file
+# of the version and printed with the version as a prefix.
+# The exit code and test time are stored in VERSION.status file.
+# Argument: version - version to test
+test_version_logged() {
+  local version="$1"
+  local log_file="$TEST_LOG_DIR/${version}.log"
+  local time_beg
+  local ret_code
+
+  time_beg=$(date '+%s')
+  set -o pipefail
+  (test_version "$version" && [ -z "$FAILED_VERSIONS" ]) 2>&1 | tee "$log_file" | sed -u "s|^|[$version] |"
+  ret_code=$?
+  set +o pipefail
+  echo "$ret_code $(( $(date '+%s') - time_beg ))" > "$TEST_LOG_DIR/${version}.status"
+}
+
+# This adds backwards compatibility if only single version needs to be testing
+# In CI we would like to test single version but VERSIONS= means, that nothing is tested
+# make test TARGET=<OS> VERSIONS=<something> ... checks single version for CLI
+# make test TARGET=<OS> SINGLE_VERSION=<something> ... checks single version from Testing Farm
+VERSIONS=${SINGLE_VERSION:-$VERSIONS}
+echo "Tested versions are: $VERSIONS"
+
+if [ "${TEST_JOBS:-1}" -gt 1 ] && [ -n "${TEST_OPENSHIFT_4}${TEST_OPENSHIFT_PYTEST}${TEST_OPENSHIFT_MODE}" ]; then
+  # The versions would switch projects of the same cluster login at the same time
+  echo "OpenShift tests share the cluster login, testing the versions sequentially."
+  TEST_JOBS=1
+fi
+
+if [ "${TEST_JOBS:-1}" -gt 1 ]; then
+  TEST_LOG_DIR=${TEST_LOG_DIR:-$(mktemp -d "/tmp/test-${OS}.XXXXXX")}
+  mkdir -p "$TEST_LOG_DIR"
+  echo "Versions are tested concurrently (at most $TEST_JOBS at a time), logs are stored in $TEST_LOG_DIR"
+  for dir in ${VERSIONS}; do
+    while [ "$(jobs -rp | wc -l)" -ge "$TEST_JOBS" ]; do
+      wait -n
+    done
+    test_version_logged "$dir" &
+  done
+  wait
+
+  echo "----------------------------------------------"
+  printf "%-20s %-8s %s\n" "VERSION" "STATUS" "TIME"
+  for dir in ${VERSIONS}; do
+    read -r ret_code duration < "$TEST_LOG_DIR/${dir}.status"
+    if [ "$ret_code" -ne 0 ]; then
+      status="FAILED"
+      FAILED_VERSIONS="${FAILED_VERSIONS} ${dir}"
+    elif [ -e "${dir}/.image-id" ]; then
+      status="OK"
+    else
+      status="SKIPPED"
+    fi
+    printf "%-20s %-8s %s\n" "$dir" "$status" "$(date -u -d "@$duration" +%H:%M:%S)"
+  done
+  echo "----------------------------------------------"
+else
+  for dir in ${VERSIONS}; do
+    test_version "$dir"
+  done
+fi
 
 if [[ -n "$FAILED_VERSIONS" ]]; then
     echo "!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!"
-    echo "Test for image ${IMAGE_NAME} FAILED in these versions ${FAILED_VERSIONS}."
+    echo "Test for image ${IMAGE_NAME:-${BASE_IMAGE_NAME:-}} FAILED in these versions ${FAILED_VERSIONS}."
     echo "!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!"
     exit 1
 fi
@@ -27,3 +27,27 @@ test $? -eq 1
 # DOWNSTREAM_BRANCH is missing
 bash $betka OS=rhel8 DOCKER_IMAGE="quay.io/rhscl/dummy" DOWNSTREAM_NAME="foo_test"
 test $? -eq 1
+
+# Dist-git clones go through a local mirror, a local bare repo stands in for dist-git.
+# The checks stop at the first failure.
+set -e
+tmpdir=$(mktemp -d)
+trap 'rm -rf "$tmpdir"' EXIT
+git init --quiet --bare "$tmpdir/dist-git/foo"
+git clone --quiet "$tmpdir/dist-git/foo" "$tmpdir/work"
+git -C "$tmpdir/work" checkout --quiet -b rhel-9.6.0
+git -C "$tmpdir/work" -c user.name=test -c user.email=test@example.com commit --quiet --allow-empty -m first
+git -C "$tmpdir/work" push --quiet origin rhel-9.6.0
+clone_from_mirror() {
+  (cd "$(dirname "$betka")" && CLONE_URL="$tmpdir/dist-git" BETKA_MIRROR_DIR="$tmpdir/mirrors" python3 -c "
+import betka
+betka.BetkaGenerator().clone_and_switch_to_branch('foo', 'rhel-9.6.0', '$tmpdir/$1')
+")
+}
+clone_from_mirror first
+test -f "$tmpdir/mirrors/foo.git/HEAD"
+git -C "$tmpdir/work" -c user.name=test -c user.email=test@example.com commit --quiet --allow-empty -m second
+git -C "$tmpdir/work" push --quiet origin rhel-9.6.0
+clone_from_mirror second
+test "$(git -C "$tmpdir/second/results" log -1 --format=%s)" = "second"
+test "$(git -C "$tmpdir/second/results" remote get-url origin)" = "$tmpdir/dist-git/foo"
@@ -0,0 +1,66 @@
+#!/bin/sh
+
+set -ex
+
+# cgroup-limits reads limits from a fake cgroup v2 sysfs tree,
+# where the process is in a nested cgroup
+cgroup_limits=$(dirname "$(readlink -f "$0")")/../shared-scripts/core/usr/bin/cgroup-limits
+tmpdir=$(mktemp -d)
+trap 'rm -rf "$tmpdir"' EXIT
+
+root="$tmpdir/sys/fs/cgroup"
+mkdir -p "$root/machine.slice/container"
+touch "$root/cgroup.controllers"
+echo "0::/machine.slice/container" > "$tmpdir/self-cgroup"
+echo "boot-1" > "$tmpdir/boot_id"
+echo "2147483648" > "$root/machine.slice/memory.max"
+echo "max" > "$root/machine.slice/container/memory.max"
+echo "1073741824" > "$root/machine.slice/container/memory.high"
+echo "max 100000" > "$root/machine.slice/cpu.max"
+echo "300000 100000" > "$root/machine.slice/container/cpu.max"
+echo "0-7" > "$root/machine.slice/container/cpuset.cpus.effective"
+echo "500" > "$root/machine.slice/pids.max"
+echo "1000" > "$root/machine.slice/container/pids.max"
+echo "200" > "$root/machine.slice/container/cpu.weight"
+
+run_cgroup_limits() {
+  "${PYTHON-python3}" - "$@" <<PYTHON
+import sys
+import importlib.util
+from importlib.machinery import SourceFileLoader
+loader = SourceFileLoader("cgroup_limits", "$cgroup_limits")
+cgroup_limits = importlib.util.module_from_spec(importlib.util.spec_from_loader("cgroup_limits", loader))
+loader.exec_module(cgroup_limits)
+cgroup_limits.CGROUP_ROOT = "$root"
+cgroup_limits.PROC_SELF_CGROUP = "$tmpdir/self-cgroup"
+cgroup_limits.PROC_BOOT_ID = "$tmpdir/boot_id"
+cgroup_limits._read_nproc = lambda: 16
+sys.argv = ["cgroup-limits"] + sys.argv[1:]
+sys.exit(cgroup_limits.main())
+PYTHON
+}
+
+output=$(run_cgroup_limits)
+echo "$output" | grep -qx "MEMORY_LIMIT_IN_BYTES=2147483648"
+echo "$output" | grep -qx "MEMORY_HIGH_IN_BYTES=1073741824"
+echo "$output" | grep -qx "NUMBER_OF_CORES=3"
+echo "$output" | grep -qx "PIDS_LIMIT=500"
+echo "$output" | grep -qx "CPU_WEIGHT=200"
+echo "$output" | grep -q "NO_MEMORY_LIMIT" && exit 1
+
+# The cached env file is used as long as the process stays in the same cgroup,
+# boot and container
+run_cgroup_limits --cache "$tmpdir/limits.env" > /dev/null
+echo "4294967296" > "$root/machine.slice/memory.max"
+run_cgroup_limits --cache "$tmpdir/limits.env" | grep -qx "MEMORY_LIMIT_IN_BYTES=2147483648"
+echo "0::/machine.slice" > "$tmpdir/self-cgroup"
+run_cgroup_limits --cache "$tmpdir/limits.env" | grep -qx "MEMORY_LIMIT_IN_BYTES=4294967296"
+echo "1073741824" > "$root/machine.slice/memory.max"
+echo "boot-2" > "$tmpdir/boot_id"
+run_cgroup_limits --cache "$tmpdir/limits.env" | grep -qx "MEMORY_LIMIT_IN_BYTES=1073741824"
+# A file written in another container, e.g. baked into the image
+echo "2147483648" > "$root/machine.slice/memory.max"
+sed -i "1s/hostname: .*/hostname: other-container/" "$tmpdir/limits.env"
+run_cgroup_limits --cache "$tmpdir/limits.env" | grep -qx "MEMORY_LIMIT_IN_BYTES=2147483648"
+
+echo "cgroup-limits tests passed"
@@ -0,0 +1,35 @@
+#!/bin/bash
+
+set -e
+
+# classify_failure tells the class of every captured log in failure-logs/CLASS/
+tests_dir=$(dirname "$(readlink -f "$0")")
+# shellcheck source=/dev/null
+source "$tests_dir/../common.sh"
+
+failed=0
+for log in "$tests_dir"/failure-logs/*/*.log; do
+  expected=$(basename "$(dirname "$log")")
+  class=$(classify_failure "$log")
+  if [ "$class" != "$expected" ]; then
+    echo "FAIL: $log classified as $class, expected $expected"
+    failed=1
+  fi
+done
+
+# The output is passed through untouched
+tmpdir=$(mktemp -d)
+trap 'rm -rf "$tmpdir"' EXIT
+log="$tests_dir/failure-logs/transient/rhel-metadata.log"
+classify_output "$tmpdir/class" < "$log" > "$tmpdir/output"
+cmp "$log" "$tmpdir/output"
+[ "$(sed -n 2p "$tmpdir/class")" == "$(grep -m1 "^Errors during downloading metadata" "$log")" ]
+
+# Patterns can be extended from a file
+echo "Error: test assertion failed" > "$tmpdir/unknown.log"
+[ "$(classify_failure "$tmpdir/unknown.log")" == "deterministic" ]
+echo "transient ^Error: test assertion" > "$tmpdir/patterns"
+[ "$(FAILURE_PATTERNS_FILE="$tmpdir/patterns" classify_failure "$tmpdir/unknown.log")" == "transient" ]
+
+[ "$failed" -eq 0 ]
+echo "Failure classifier test completed successfully."
@@ -0,0 +1,108 @@
+#!/bin/bash
+
+# Check that generator.py renders the same sources with the in-process
+# distgen engine as with the 'dg' command, using the test repository
+# in tests/generator.
+
+set -ex
+
+tests_dir=$(dirname "$(readlink -f "$0")")
+generator=$tests_dir/../generator.py
+workdir=$(mktemp -d)
+trap 'rm -rf "$workdir"' EXIT
+
+# generate NAME [ARGS...]
+# Run generator.py in $workdir/NAME, a copy of the test repository
+generate() {
+  local name=$1 ; shift
+  [ -d "$workdir/$name" ] || cp -r "$tests_dir/generator" "$workdir/$name"
+  (cd "$workdir/$name" && "${PYTHON-python3}" "$generator" -m manifest.yml -s specs/multispec.yml "$@")
+}
+
+# check NAME [ARGS...]
+# Run generator.py --check in $workdir/NAME
+check() {
+  local name=$1 ; shift
+  (cd "$workdir/$name" && "${PYTHON-python3}" "$generator" -m manifest.yml -s specs/multispec.yml --check "$@")
+}
+
+# One version per call, like 'make generate' used to do
+generate dg -v 1.0 -e dg
+generate dg -v 2.0 -e dg
+generate python -v 1.0
+generate python -v 2.0
+diff -r "$workdir/dg" "$workdir/python"
+
+# All versions at once, serially and in parallel
+generate serial -v 1.0 2.0 -j 1
+diff -r "$workdir/python" "$workdir/serial"
+generate parallel --all -j 2
+diff -r "$workdir/python" "$workdir/parallel"
+# Messages of dg are logged under the version they belong to
+generate dg-parallel --all -j 2 -e dg > "$workdir/generate.log" 2>&1
+diff -r "$workdir/python" "$workdir/dg-parallel"
+sed -n '/^==> Version 1.0$/,/^==> Version 2.0$/p' "$workdir/generate.log" > "$workdir/version.log"
+grep -q "dg: CRITICAL: This combination is excluded" "$workdir/version.log"
+
+# A template that fails to render fails the generation of its versions
+cp -r "$tests_dir/generator" "$workdir/broken"
+echo "{% if %}" >> "$workdir/broken/src/README.md"
+generate broken --all -j 2 > "$workdir/generate.log" && exit 1
+grep -qx "\[ERROR\] Generating sources failed for versions: 1.0 2.0" "$workdir/generate.log"
+generate broken -v 1.0 -j 1 > "$workdir/generate.log" && exit 1
+grep -qx "\[ERROR\] Generating sources failed for versions: 1.0" "$workdir/generate.log"
+
+# Excluded combination in the multispec matrix is not generated
+test ! -e "$workdir/python/1.0/Dockerfile.c10s"
+test -f "$workdir/python/2.0/Dockerfile.c10s"
+grep -q "^FROM quay.io/sclorg/s2i-core:c10s$" "$workdir/python/2.0/Dockerfile.c10s"
+# Modes and symlinks from the manifest are applied
+test -x "$workdir/python/1.0/test/run"
+test -L "$workdir/python/1.0/test/test-app/run"
+
+# Nothing is cached by default, changes of included templates are picked up
+echo "included 1" > "$workdir/serial/src/part.inc"
+sed -i '1i {% include "src/part.inc" %}' "$workdir/serial/src/README.md"
+generate serial -v 1.0 -j 1 > "$workdir/generate.log"
+grep -q "up to date" "$workdir/generate.log" && exit 1
+echo "included 2" > "$workdir/serial/src/part.inc"
+generate serial -v 1.0 -j 1 > "$workdir/generate.log"
+grep -q "^included 2$" "$workdir/serial/1.0/README.md"
+test ! -e "$workdir/serial/.generator-cache"
+
+# With a cache, nothing is generated again when the inputs did not change
+generate serial -v 1.0 2.0 -j 1 -c cache
+touch -d "2000-01-01" "$workdir/serial/1.0/Dockerfile.fedora"
+generate serial -v 1.0 2.0 -j 1 -c cache > "$workdir/generate.log"
+grep -q "Version 1.0: 7 generated files are up to date." "$workdir/generate.log"
+test "$(stat -c %Y "$workdir/serial/1.0/Dockerfile.fedora")" -eq "$(date -d "2000-01-01" +%s)"
+# Only outputs of the changed template are generated again
+echo "# changed" >> "$workdir/serial/src/Dockerfile.template"
+generate serial -v 1.0 -j 1 -c cache > "$workdir/generate.log"
+grep -q "Version 1.0: 4 generated files are up to date." "$workdir/generate.log"
+test "$(tail -n 1 "$workdir/serial/1.0/Dockerfile.fedora")" == "# changed"
+# Outputs of removed rules are removed
+sed -i '/^SYMLINK_RULES:/,$d' "$workdir/serial/manifest.yml"
+generate serial -v 1.0 -j 1 -c cache
+test ! -e "$workdir/serial/1.0/test/test-app"
+
+# Check mode compares the generated files with the working tree,
+# without writing anything
+check python --all
+check dg --all -e dg -j 1
+echo "# changed" >> "$workdir/python/1.0/README.md"
+chmod -x "$workdir/python/2.0/test/run"
+rm "$workdir/python/1.0/test/test-app/run"
+touch "$workdir/python/1.0/Dockerfile.c10s"
+cp -a "$workdir/python" "$workdir/drifted"
+check python --all > "$workdir/check.log" && exit 1
+cat "$workdir/check.log"
+grep -qx "DIFF	1.0/README.md: content differs" "$workdir/check.log"
+grep -qx "DIFF	2.0/test/run: should be executable" "$workdir/check.log"
+grep -qx "DIFF	1.0/test/test-app/run: is missing" "$workdir/check.log"
+grep -qx "DIFF	1.0/Dockerfile.c10s: should not exist" "$workdir/check.log"
+check python --all --fail-fast > "$workdir/check.log" && exit 1
+test "$(grep -c "^DIFF" "$workdir/check.log")" -eq 1
+diff -r "$workdir/python" "$workdir/drifted"
+
+echo "generator.py test completed successfully."
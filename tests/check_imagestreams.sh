@@ -8,6 +8,11 @@ show_all_imagestreams=$(dirname "$(readlink -f "$0")")/../show_all_imagestreams.
 test $? -eq 1
 "${PYTHON-python3}" "$check_imagestreams" "2.4"
 test $? -eq 0
+"${PYTHON-python3}" "$check_imagestreams" --latest "2.4" "2.4" "2.5"
+test $? -eq 1 || exit 1
+report=$("${PYTHON-python3}" "$check_imagestreams" --report - --latest "2.4" "2.4" "2.5" | tail -n 1)
+test "${report#*'"missing_versions": ["2.5"]'}" != "$report" || exit 1
+echo "2.5 reported as missing"
 
 echo "This tests check if 'show_all_imagestreams.py' returns proper output"
 output=$("${PYTHON-python3}" "$show_all_imagestreams")
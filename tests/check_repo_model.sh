@@ -0,0 +1,42 @@
+#!/bin/bash
+
+# Check that repo_model.py reads VERSIONS assigned in the forms make accepts
+# and fails instead of returning no versions for the ones it cannot evaluate.
+
+set -ex
+
+tests_dir=$(dirname "$(readlink -f "$0")")
+repo_model=$tests_dir/../repo_model.py
+repo=$(mktemp -d)
+trap 'rm -rf "$repo"' EXIT
+
+# check_versions EXPECTED
+# -----------------------------
+# Checks that the versions read from the Makefile in $repo are EXPECTED
+# Argument: EXPECTED - space separated list of versions
+check_versions() {
+  test "$("$repo_model" --no-cache -C "$repo" | python3 -c 'import json, sys; print(*json.load(sys.stdin)["versions"])')" == "$1"
+}
+
+printf 'VERSIONS = 1.0 2.0\n' > "$repo/Makefile"
+check_versions "1.0 2.0"
+
+printf 'VERSIONS ?= 1.0 2.0 # the default\n' > "$repo/Makefile"
+check_versions "1.0 2.0"
+
+printf 'export VERSIONS := 1.0 \\\n  2.0 \\\n  3.0\n' > "$repo/Makefile"
+check_versions "1.0 2.0 3.0"
+
+printf 'VERSIONS = 1.0\nVERSIONS += 2.0\nVERSIONS ?= 3.0\n' > "$repo/Makefile"
+check_versions "1.0 2.0"
+
+# A value make has to expand and a Makefile without VERSIONS are errors
+printf 'OLD = 1.0\nVERSIONS = $(OLD) 2.0\n' > "$repo/Makefile"
+"$repo_model" --no-cache -C "$repo" 2>"$repo/err" && exit 1
+grep -q "^ERROR: VERSIONS in .* cannot be evaluated" "$repo/err"
+
+printf 'BASE_IMAGE_NAME = test\n' > "$repo/Makefile"
+"$repo_model" --no-cache -C "$repo" 2>"$repo/err" && exit 1
+grep -q "^ERROR: VERSIONS is not set" "$repo/err"
+
+echo "repo_model.py test completed successfully."
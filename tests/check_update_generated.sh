@@ -0,0 +1,85 @@
+#!/bin/bash
+
+# Check that update-generated.sh in the INCREMENTAL mode commits the same
+# generated tree as a full run, in a repository with two versions generated
+# from a shared template.
+
+set -ex
+
+tests_dir=$(dirname "$(readlink -f "$0")")
+update_generated=$tests_dir/../update-generated.sh
+workdir=$(mktemp -d)
+trap 'rm -rf "$workdir"' EXIT
+export GIT_AUTHOR_NAME=test GIT_AUTHOR_EMAIL=test@example.com
+export GIT_COMMITTER_NAME=test GIT_COMMITTER_EMAIL=test@example.com
+
+repo=$workdir/repo
+git init -q -b main "$repo"
+cd "$repo"
+mkdir -p common src 1.0 2.0
+cp "$tests_dir/../repo_model.py" common/
+cat > Makefile <<'EOF'
+VERSIONS = 1.0 2.0
+
+generate:
+	for version in $(VERSIONS); do \
+	  cat src/template $$version/own > $$version/generated || exit 1; \
+	done
+
+generate-all: generate
+EOF
+echo "template 1" > src/template
+echo "own 1.0" > 1.0/own
+echo "own 2.0" > 2.0/own
+git add -A
+git commit -q -m "source 1"
+git checkout -q --orphan generated
+git rm -q -r --cached .
+git commit -q --allow-empty -m "generated"
+git clean -q -f -d
+git checkout -q main
+git branch incremental generated
+
+# sync [SOURCE_BRANCH]
+# Syncs the source branch (main by default) into the 'generated' branch by
+# a full run and into the 'incremental' one by an incremental run, and checks
+# they are the same
+sync() {
+  local source=${1:-main}
+  "$update_generated" "$source" generated
+  git checkout -q main
+  INCREMENTAL=1 WORKTREE_DIR="$workdir/worktrees" "$update_generated" "$source" incremental
+  git diff --exit-code generated incremental
+  test "$(git log -1 --format=%s incremental)" == "$(git log -1 --format=%s generated)"
+}
+
+sync
+test "$(git show incremental:1.0/generated)" == "template 1
+own 1.0"
+
+# A change in a single version
+echo "own 1.0 changed" > 1.0/own
+git commit -q -a -m "source 2"
+sync
+test "$(git log -1 --format=%s incremental)" == "auto-sync: master commit $(git rev-parse main)"
+
+# A change of the template affects all the versions
+echo "template 2" > src/template
+git commit -q -a -m "source 3"
+sync
+
+# A branch other than HEAD is recorded as the synced commit, so the next run
+# compares with it and reverts its change of 2.0
+git checkout -q -b feature
+echo "own 2.0 feature" > 2.0/own
+git commit -q -a -m "feature"
+git checkout -q main
+sync feature
+test "$(git log -1 --format=%s incremental)" == "auto-sync: master commit $(git rev-parse feature)"
+echo "own 1.0 changed again" > 1.0/own
+git commit -q -a -m "source 4"
+sync
+test "$(git show incremental:2.0/generated)" == "template 2
+own 2.0"
+
+echo "update-generated.sh test completed successfully."
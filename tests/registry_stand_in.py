@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+
+"""
+Minimal registry (HTTP API v2) serving manifest digests for the tests of
+registry_probe.py. Manifests are only served with a bearer token from /token,
+manifests with the digest "denied" are never served.
+
+Every request is appended to the log file as "<connection> <method> <path>".
+
+Usage:
+    registry_stand_in.py PORT_FILE LOG_FILE REPOSITORY:TAG=DIGEST ...
+"""
+
+import sys
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict
+
+TOKEN: str = "stand-in-token"
+
+
+class RegistryHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    manifests: Dict[str, str] = {}
+    log_file: str = ""
+
+    def log_message(self, format: str, *args: object) -> None:
+        with open(self.log_file, "a") as f:
+            f.write(f"{id(self.connection)} {self.command} {self.path}\n")
+
+    def reply(self, code: int, headers: Dict[str, str], body: bytes = b"") -> None:
+        self.send_response(code)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        if self.path.startswith("/token?"):
+            self.reply(200, {}, f'{{"token": "{TOKEN}"}}'.encode())
+            return
+        self.do_HEAD()
+
+    def do_HEAD(self) -> None:
+        repository, _, reference = self.path[len("/v2/") :].partition("/manifests/")
+        if self.headers.get("Authorization") != f"Bearer {TOKEN}":
+            host = self.headers["Host"]
+            challenge = (
+                f'Bearer realm="http://{host}/token",service="stand-in",'
+                f'scope="repository:{repository}:pull"'
+            )
+            self.reply(401, {"WWW-Authenticate": challenge})
+            return
+        digest = self.manifests.get(f"{repository}:{reference}")
+        if digest is None:
+            self.reply(404, {})
+            return
+        if digest == "denied":
+            self.reply(403, {})
+            return
+        self.reply(200, {"Docker-Content-Digest": digest}, b"{}")
+
+
+def main() -> None:
+    port_file, RegistryHandler.log_file = sys.argv[1:3]
+    RegistryHandler.manifests = dict(arg.split("=", 1) for arg in sys.argv[3:])
+    server = ThreadingHTTPServer(("127.0.0.1", 0), RegistryHandler)
+    with open(port_file, "w") as f:
+        f.write(str(server.server_port))
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -11,6 +11,97 @@ SOURCE_BRANCH=${1:-$COMMIT}
 # into this git branch
 GENERATED_BRANCH=${2:-generated}
 
+# recorded in the generated commits, the incremental mode compares with it
+source_commit=$(git rev-parse "$SOURCE_BRANCH^{commit}")
+
+# INCREMENTAL - when set, generate in persistent git worktrees instead of a
+#               fresh clone; only the versions affected by the changes since
+#               the last synced commit are generated and copied over
+# WORKTREE_DIR - directory for the persistent worktrees,
+#                defaults to update-generated in the git directory
+if [ -n "${INCREMENTAL:-}" ]; then
+    worktree_dir=${WORKTREE_DIR:-$(git rev-parse --path-format=absolute --git-common-dir)/update-generated}
+    srcdir=$worktree_dir/source
+    gendir=$worktree_dir/generated
+
+    # Reuse the worktrees of the previous run
+    git worktree prune
+    if [ -d "$srcdir" ]; then
+        git -C "$srcdir" checkout --force --detach "$source_commit"
+    else
+        git worktree add --detach "$srcdir" "$source_commit"
+    fi
+    git -C "$srcdir" submodule update --init
+    # The generated branch is not checked out in the worktree, so that it can
+    # still be checked out elsewhere; it is moved to the new commit at the end
+    generated_commit=$(git rev-parse "refs/heads/$GENERATED_BRANCH")
+    if [ -d "$gendir" ]; then
+        git -C "$gendir" checkout --force --detach "$generated_commit"
+    else
+        git worktree add --detach "$gendir" "$generated_commit"
+    fi
+    git -C "$gendir" clean -f -d
+
+    versions=$(eval "$(python3 "$srcdir/common/repo_model.py" --directory "$srcdir" --no-cache --format shell)" \
+               && echo "$REPO_VERSIONS")
+
+    # Versions with changes in their own directory need to be generated and
+    # copied again, a change anywhere else (templates, manifests, multispec,
+    # the common submodule) may affect all of them
+    last_commit=$(git log -1 --format=%s "$generated_commit" | sed -n 's/^auto-sync: master commit //p')
+    changed_versions=$versions
+    if [ -n "$last_commit" ] && git cat-file -e "$last_commit^{commit}" 2>/dev/null; then
+        changed_versions=""
+        for path in $(git diff --name-only --no-renames "$last_commit" "$source_commit"); do
+            top=${path%%/*}
+            case " $versions " in
+                *" $top "*) ;;
+                *) changed_versions=$versions; break ;;
+            esac
+            case " $changed_versions " in
+                *" $top "*) ;;
+                *) changed_versions="$changed_versions $top" ;;
+            esac
+        done
+        # Versions which are not generated at all any more
+        for path in "$gendir"/*; do
+            top=${path##*/}
+            case " $versions " in
+                *" $top "*) ;;
+                *) [ -e "$path" ] && rm -rf -- "$path" ;;
+            esac
+        done
+    else
+        # Nothing to compare with, start with an empty generated tree
+        # shellcheck disable=SC2115
+        rm -rf -- "$gendir"/*
+    fi
+
+    echo "Versions to generate:${changed_versions:- none}"
+    if [ -n "$changed_versions" ]; then
+        # The versions are generated from scratch, without the generator cache,
+        # to get the same files as a full run
+        # shellcheck disable=SC2086
+        make -C "$srcdir" generate GENERATOR_CACHE= VERSIONS="$(echo $changed_versions)"
+        for i in $changed_versions; do
+            rm -rf -- "${gendir:?}/$i"
+            cp -r "$srcdir/$i" "$gendir/"
+        done
+    fi
+
+    # shellcheck disable=SC2086
+    git -C "$gendir" add --all -- $versions
+    git -C "$gendir" add --update
+
+    if ! git -C "$gendir" diff --cached --exit-code --quiet ; then
+        git -C "$gendir" commit -m "auto-sync: master commit $source_commit"
+        git update-ref "refs/heads/$GENERATED_BRANCH" "$(git -C "$gendir" rev-parse HEAD)" "$generated_commit"
+    else
+        echo "Nothing changed"
+    fi
+    exit 0
+fi
+
 git clean -f -d
 
 # switch to generated branch for working env; and switch back later
@@ -46,7 +137,8 @@ trap cleanup EXIT
 )
 
 # copy the relevant (generated) content from $srcdir
-versions=$(sed -n 's/^VERSIONS[[:space:]]*=//p' "$srcdir"/Makefile)
+versions=$(eval "$(python3 "$srcdir/common/repo_model.py" --directory "$srcdir" --no-cache --format shell)" \
+           && echo "$REPO_VERSIONS")
 for i in $versions; do
     cp -r "$srcdir/$i" .
 done
@@ -66,7 +158,7 @@ git add $versions
 )
 
 if ! git diff --cached --exit-code --quiet ; then
-    git commit -m "auto-sync: master commit $COMMIT"
+    git commit -m "auto-sync: master commit $source_commit"
 else
     echo "Nothing changed"
 fi